@@ -0,0 +1,203 @@
+import os
+import re
+import copy
+import json
+import math
+import time
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+# Answers kept at most; 0 turns the cache off
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+ANSWER_CACHE_MAX_BYTES = int(os.environ.get("ANSWER_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# Seconds an answer stays valid if its corpora do not change
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 3600))
+# Cosine similarity at which a differently worded query counts as the same
+# question; 0 only serves exact (normalized) matches
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0.95))
+VECTOR_BUCKETS = 1 << 20
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase words of the query, without punctuation and extra whitespace."""
+    return " ".join(_WORD_RE.findall(query.lower()))
+
+
+def query_vector(normalized: str) -> Dict[int, float]:
+    """Unit-length hashed vector of the words and word pairs of a normalized query."""
+    words = normalized.split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector: Dict[int, float] = {}
+    for feature in features:
+        bucket = zlib.crc32(feature.encode("utf-8")) % VECTOR_BUCKETS
+        vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+    return {bucket: weight / norm for bucket, weight in vector.items()}
+
+
+def _cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(bucket, 0.0) for bucket, weight in a.items())
+
+
+class _Entry:
+    __slots__ = ("normalized", "corpora", "vector", "response", "seconds", "created", "size")
+
+    def __init__(self, normalized, corpora, vector, response, seconds):
+        self.normalized = normalized
+        self.corpora = corpora
+        self.vector = vector
+        self.response = response
+        self.seconds = seconds
+        self.created = time.monotonic()
+        self.size = len(normalized) + len(json.dumps(response, default=str)) + 48 * len(vector)
+
+
+class AnswerCache:
+    """
+    Caches chat answers by normalized query and the set of corpora they
+    were generated from. A query that misses exactly can still hit an
+    answer for the same corpora whose query vector is at least
+    `similarity` close. Entries expire after `ttl` seconds; beyond
+    `max_entries` or `max_bytes` the least recently used are evicted.
+    invalidate_corpus() drops every answer that used a corpus.
+
+    `generation(corpus)` returns a counter that moves whenever a corpus
+    changes (see RetrievalCache.generation). Callers read it before
+    retrieving and pass the values to put(), which refuses the answer if
+    any of them moved while it was generated.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, max_bytes: int = ANSWER_CACHE_MAX_BYTES,
+                 ttl: float = ANSWER_CACHE_TTL, similarity: float = ANSWER_CACHE_SIMILARITY,
+                 generation: Optional[Callable[[str], int]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.similarity = similarity
+        self.generation = generation
+        self._entries: "OrderedDict[Tuple[str, Tuple[str, ...]], _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0, "expired": 0,
+                       "invalidated": 0, "stale": 0, "seconds_saved": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _remove(self, key) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _find(self, normalized: str, corpora: Tuple[str, ...],
+              similar: bool = True) -> Tuple[Optional[_Entry], float]:
+        """Exact or, with `similar`, most similar live entry for the query. Caller holds the lock."""
+        now = time.monotonic()
+        key = (normalized, corpora)
+        entry = self._entries.get(key)
+        if entry and now - entry.created <= self.ttl:
+            self._entries.move_to_end(key)
+            return entry, 1.0
+        if not similar or not self.similarity:
+            return None, 0.0
+        vector = query_vector(normalized)
+        best, best_key, best_similarity = None, None, self.similarity
+        for other_key, other in self._entries.items():
+            if other.corpora != corpora or now - other.created > self.ttl:
+                continue
+            similarity = _cosine(vector, other.vector)
+            if similarity >= best_similarity:
+                best, best_key, best_similarity = other, other_key, similarity
+        if best:
+            self._entries.move_to_end(best_key)
+        return best, best_similarity
+
+    def get(self, query: str, corpora: Iterable[str], similar: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Returns a copy of the cached response with a "cache" entry
+        describing the hit, or None on a miss. With similar=False only the
+        exact normalized query matches: queries that embed a long shared
+        text, such as a conversation's history, look alike whatever the
+        question at their end.
+        """
+        if not self.enabled:
+            return None
+        start = time.monotonic()
+        normalized = normalize_query(query)
+        with self._lock:
+            entry, similarity = self._find(normalized, tuple(sorted(set(corpora))), similar)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            exact = entry.normalized == normalized
+            self._stats["hits" if exact else "similar_hits"] += 1
+            self._stats["seconds_saved"] += max(0.0, entry.seconds - (time.monotonic() - start))
+            response = copy.deepcopy(entry.response)
+            age = time.monotonic() - entry.created
+        response["cache"] = {"hit": "exact" if exact else "similar", "similarity": round(similarity, 3),
+                             "age": round(age, 1)}
+        return response
+
+    def put(self, query: str, corpora: Iterable[str], response: Dict[str, Any], seconds: float,
+            generations: Optional[Dict[str, int]] = None) -> None:
+        """
+        Stores a response that took `seconds` to produce from corpora at
+        `generations`, unless one of them changed since.
+        """
+        if not self.enabled:
+            return
+        normalized = normalize_query(query)
+        entry = _Entry(normalized, tuple(sorted(set(corpora))), query_vector(normalized),
+                       copy.deepcopy(response), seconds)
+        if entry.size > self.max_bytes:
+            return
+        key = (entry.normalized, entry.corpora)
+        with self._lock:
+            if generations and self.generation and any(self.generation(corpus_name) != generation
+                                                       for corpus_name, generation in generations.items()):
+                self._stats["stale"] += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            now = time.monotonic()
+            for old_key in [k for k, e in self._entries.items() if now - e.created > self.ttl]:
+                self._remove(old_key)
+                self._stats["expired"] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def invalidate_corpus(self, corpus_name: str) -> int:
+        """Drops every answer generated from `corpus_name`; returns how many."""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if corpus_name in entry.corpora]
+            for key in stale:
+                self._remove(key)
+            self._stats["invalidated"] += len(stale)
+        if stale:
+            logging.info(f"Dropped {len(stale)} cached answers of {corpus_name}")
+        return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes, "max_entries": self.max_entries,
+                          "max_bytes": self.max_bytes})
+        lookups = stats["hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["similar_hits"]) / lookups, 4) if lookups else 0.0
+        stats["seconds_saved"] = round(stats["seconds_saved"], 3)
+        return stats
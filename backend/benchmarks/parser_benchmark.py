@@ -0,0 +1,52 @@
+"""
+Micro-benchmark for the scraper's HTML parser backends.
+
+Parses every page in benchmarks/fixtures with each available backend and
+prints pages/sec, plus how many hrefs and text characters each backend
+extracted so differences in output are visible next to the timings.
+
+    python benchmarks/parser_benchmark.py [--rounds 20]
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from scraper import available_html_parsers, parse_html  # noqa: E402
+
+FIXTURES_DIR = os.path.join(BACKEND_DIR, "benchmarks", "fixtures")
+
+
+def load_fixtures():
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.html"))):
+        with open(path, "rb") as f:
+            fixtures[os.path.basename(path)] = f.read()
+    return fixtures
+
+
+def run(rounds):
+    fixtures = load_fixtures()
+    if not fixtures:
+        sys.exit(f"No fixtures found in {FIXTURES_DIR}")
+
+    print(f"{'fixture':<20} {'backend':<8} {'KB':>6} {'pages/sec':>10} {'hrefs':>6} {'chars':>8}")
+    for name, content in fixtures.items():
+        for backend in available_html_parsers():
+            text, hrefs = parse_html(content, backend)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                parse_html(content, backend)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<20} {backend:<8} {len(content) // 1024:>6} {rounds / elapsed:>10.1f} "
+                  f"{len(hrefs):>6} {len(text):>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20, help="parses per fixture and backend")
+    run(parser.parse_args().rounds)
@@ -0,0 +1,181 @@
+import os
+import re
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Defaults for corpora that did not choose their own chunk parameters
+DEFAULT_CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 512))
+DEFAULT_CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 100))
+# Documents up to this many tokens are packed together into shard files of
+# about SHARD_TARGET_TOKENS instead of being staged one file each.
+PACK_MAX_DOCUMENT_TOKENS = int(os.environ.get("PACK_MAX_DOCUMENT_TOKENS", 1024))
+SHARD_TARGET_TOKENS = int(os.environ.get("SHARD_TARGET_TOKENS", 8192))
+# Sections shorter than this are merged into a neighbour rather than becoming a chunk of their own
+MIN_CHUNK_TOKENS = int(os.environ.get("MIN_CHUNK_TOKENS", 32))
+TOKEN_ENCODING = os.environ.get("TOKEN_ENCODING", "cl100k_base")
+
+SOURCE_MARKER = "Source: {source}"
+
+_HEADING_RE = re.compile(r"^#{1,6}\s")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_BLOCK_RE = re.compile(r"\n\s*\n")
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Loads the tiktoken encoding once; None if it is unavailable (e.g. offline)."""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+            except Exception as e:
+                logging.warning(f"Could not load tiktoken encoding {TOKEN_ENCODING}, estimating tokens: {e}")
+                _encoding = False
+        return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def chunking_params(chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None) -> Dict[str, int]:
+    """Validated chunk parameters, falling back to the defaults."""
+    size = int(chunk_size or DEFAULT_CHUNK_SIZE)
+    overlap = int(chunk_overlap if chunk_overlap is not None else DEFAULT_CHUNK_OVERLAP)
+    if size < 64:
+        raise ValueError("chunk_size must be at least 64 tokens")
+    if not 0 <= overlap < size:
+        raise ValueError("chunk_overlap must be between 0 and chunk_size")
+    return {"chunk_size": size, "chunk_overlap": overlap}
+
+
+def _split_long(text: str, chunk_size: int) -> List[str]:
+    """Splits a block larger than chunk_size on sentence boundaries (or words, for run-on text)."""
+    pieces = _SENTENCE_RE.split(text)
+    if len(pieces) == 1:
+        pieces = text.split(" ")
+    parts, current, tokens = [], [], 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece) + 1
+        if current and tokens + piece_tokens > chunk_size:
+            parts.append(" ".join(current))
+            current, tokens = [], 0
+        current.append(piece)
+        tokens += piece_tokens
+    if current:
+        parts.append(" ".join(current))
+    return parts
+
+
+def chunk_document(text: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[str]:
+    """
+    Splits text into chunks of at most about chunk_size tokens. Blank lines
+    separate paragraphs and Markdown headings start a new chunk; paragraphs
+    are packed together up to the limit and oversized ones are split on
+    sentences. Fragments below MIN_CHUNK_TOKENS join the chunk before them.
+    """
+    chunks: List[Tuple[str, int]] = []
+    current: List[str] = []
+    tokens = 0
+
+    def close():
+        nonlocal current, tokens
+        if current:
+            chunks.append(("\n\n".join(current), tokens))
+        current, tokens = [], 0
+
+    for block in _BLOCK_RE.split(text):
+        block = block.strip()
+        if not block:
+            continue
+        block_tokens = count_tokens(block)
+        if _HEADING_RE.match(block) and tokens >= MIN_CHUNK_TOKENS:
+            close()
+        if block_tokens > chunk_size:
+            close()
+            for part in _split_long(block, chunk_size):
+                chunks.append((part, count_tokens(part)))
+            continue
+        if current and tokens + block_tokens > chunk_size:
+            close()
+        current.append(block)
+        tokens += block_tokens
+    close()
+
+    merged: List[Tuple[str, int]] = []
+    for chunk, chunk_tokens in chunks:
+        if merged and chunk_tokens < MIN_CHUNK_TOKENS and merged[-1][1] + chunk_tokens <= chunk_size:
+            merged[-1] = (f"{merged[-1][0]}\n\n{chunk}", merged[-1][1] + chunk_tokens)
+        else:
+            merged.append((chunk, chunk_tokens))
+    return [chunk for chunk, _ in merged]
+
+
+def render_document(source: str, text: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    """
+    Document text as staged. Vertex splits each file into chunk_size
+    windows itself, so the local split only decides where the source
+    marker goes: the text is cut into sections of at most half a chunk on
+    heading and paragraph boundaries, and every section starts with the
+    marker. Any window the server cuts, including one spanning two
+    documents of a shard, then contains a marker naming the document it
+    came from.
+    """
+    marker = SOURCE_MARKER.format(source=source)
+    return "\n\n".join(f"{marker}\n\n{section}" for section in chunk_document(text, max(1, chunk_size // 2)))
+
+
+class ShardPacker:
+    """
+    Turns documents into staging units of rendered text (see
+    render_document). Large documents become a unit of their own, while
+    small ones are packed together until a shard reaches
+    SHARD_TARGET_TOKENS. Units are (sources, text) pairs.
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, shard_tokens: int = SHARD_TARGET_TOKENS,
+                 pack_max_tokens: int = PACK_MAX_DOCUMENT_TOKENS):
+        self.chunk_size = chunk_size
+        self.shard_tokens = shard_tokens
+        self.pack_max_tokens = pack_max_tokens
+        self.stats = {"documents": 0, "units": 0, "shards": 0}
+        self._sources: List[str] = []
+        self._parts: List[str] = []
+        self._tokens = 0
+
+    def add(self, source: str, text: str) -> List[Tuple[List[str], str]]:
+        """Adds a document and returns the units that are ready to stage."""
+        rendered = render_document(source, text, self.chunk_size)
+        if not rendered:
+            return []
+        self.stats["documents"] += 1
+        tokens = count_tokens(rendered)
+        if tokens > self.pack_max_tokens:
+            self.stats["units"] += 1
+            return [([source], rendered)]
+        ready = []
+        if self._parts and self._tokens + tokens > self.shard_tokens:
+            ready = self.flush()
+        self._sources.append(source)
+        self._parts.append(rendered)
+        self._tokens += tokens
+        return ready
+
+    def flush(self) -> List[Tuple[List[str], str]]:
+        """Returns the current shard, if any, as a unit."""
+        if not self._parts:
+            return []
+        unit = (self._sources, "\n\n".join(self._parts))
+        self._sources, self._parts, self._tokens = [], [], 0
+        self.stats["units"] += 1
+        if len(unit[0]) > 1:
+            self.stats["shards"] += 1
+        return [unit]
@@ -0,0 +1,177 @@
+import os
+import re
+import logging
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from chunking import DEFAULT_CHUNK_OVERLAP, SOURCE_MARKER, count_tokens
+
+# Most tokens of retrieved text put into one prompt
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 6000))
+# A chunk sharing at least this fraction of its word shingles with a better
+# ranked chunk is dropped as a duplicate
+CONTEXT_DUPLICATE_THRESHOLD = float(os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", 0.8))
+# Share of the rerank score that comes from retrieval similarity; the rest
+# comes from how many query terms the chunk contains
+RERANK_SIMILARITY_WEIGHT = float(os.environ.get("RERANK_SIMILARITY_WEIGHT", 0.7))
+# Overlaps between the end of one chunk and the start of another shorter
+# than this are left in place
+MIN_OVERLAP_WORDS = 8
+# Longest overlap looked for; neighbouring chunks only share chunk_overlap
+# tokens, which is never more words than that
+MAX_OVERLAP_WORDS = int(os.environ.get("CONTEXT_MAX_OVERLAP_WORDS", 2 * DEFAULT_CHUNK_OVERLAP))
+SHINGLE_SIZE = 3
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_TOKEN_RE = re.compile(r"\S+")
+_SOURCE_RE = re.compile("^" + re.escape(SOURCE_MARKER.split("{source}")[0]) + r"(\S+)", re.MULTILINE)
+
+
+class ContextChunk(NamedTuple):
+    text: str
+    source: str
+    corpus: str
+    similarity: float
+    score: float = 0.0
+
+
+class PackedContext(NamedTuple):
+    text: str
+    chunks: List[ContextChunk]
+    stats: Dict[str, int]
+
+
+def _similarity(context: Any) -> float:
+    """Retrieval similarity of a context: its score if set, else 1 - cosine distance."""
+    score = getattr(context, "score", 0.0) or 0.0
+    if score:
+        return float(score)
+    return max(0.0, 1.0 - float(getattr(context, "distance", 0.0) or 0.0))
+
+
+def chunks_from_contexts(corpus: str, contexts: Iterable[Any]) -> List[ContextChunk]:
+    """
+    Turns the contexts of a retrieval query into chunks. The source is the
+    document's `Source:` marker when the chunk contains one, else the URI of
+    the staged file it came from.
+    """
+    chunks = []
+    for context in contexts:
+        text = (context.text or "").strip()
+        if not text:
+            continue
+        marker = _SOURCE_RE.search(text)
+        source = marker.group(1) if marker else getattr(context, "source_uri", "") or corpus
+        if marker and marker.start() == 0:
+            # The marker is rendered in front of the chunk anyway
+            text = text[marker.end():].strip()
+        chunks.append(ContextChunk(text, source, corpus, _similarity(context)))
+    return chunks
+
+
+def _terms(text: str) -> Set[str]:
+    return {word for word in _WORD_RE.findall(text.lower()) if len(word) > 2}
+
+
+def rerank(query: str, chunks: List[ContextChunk]) -> List[ContextChunk]:
+    """
+    Orders chunks from all corpora on one scale: retrieval similarity blended
+    with the share of query terms the chunk contains. The lexical part keeps
+    a corpus whose similarities run high from crowding out the others.
+    """
+    query_terms = _terms(query)
+    ranked = []
+    for chunk in chunks:
+        coverage = len(query_terms & _terms(chunk.text)) / len(query_terms) if query_terms else 0.0
+        score = RERANK_SIMILARITY_WEIGHT * chunk.similarity + (1 - RERANK_SIMILARITY_WEIGHT) * coverage
+        ranked.append(chunk._replace(score=round(score, 4)))
+    ranked.sort(key=lambda chunk: chunk.score, reverse=True)
+    return ranked
+
+
+def _shingles(words: List[str]) -> Set[str]:
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _overlap(first: List[str], second: List[str]) -> int:
+    """
+    Number of words at the end of `first` that repeat at the start of
+    `second`, up to MAX_OVERLAP_WORDS. Only sizes where the first word
+    lines up are compared in full.
+    """
+    if not second:
+        return 0
+    start = second[0]
+    for size in range(min(len(first) - 1, len(second) - 1, MAX_OVERLAP_WORDS), MIN_OVERLAP_WORDS - 1, -1):
+        if first[-size] == start and first[-size:] == second[:size]:
+            return size
+    return 0
+
+
+def deduplicate(chunks: List[ContextChunk]) -> Tuple[List[ContextChunk], Dict[str, int]]:
+    """
+    Drops chunks that are mostly contained in a better ranked one and trims
+    the words a chunk repeats from the start or end of a kept one, as left
+    by chunk_overlap between neighbouring chunks. `chunks` must be ranked
+    best first.
+    """
+    kept: List[Tuple[ContextChunk, List[str], Set[str]]] = []
+    stats = {"duplicates": 0, "trimmed": 0}
+    for chunk in chunks:
+        words = _TOKEN_RE.findall(chunk.text)
+        shingles = _shingles(words)
+        if any(len(shingles & other) >= CONTEXT_DUPLICATE_THRESHOLD * len(shingles) for _, _, other in kept):
+            stats["duplicates"] += 1
+            continue
+        text = chunk.text
+        for _, other_words, _ in kept:
+            size = _overlap(other_words, words)
+            if size:
+                # Cut right after the last repeated word so the rest keeps its line breaks
+                end = list(_TOKEN_RE.finditer(text))[size - 1].end()
+                text = text[end:].strip()
+                words = words[size:]
+                stats["trimmed"] += 1
+                continue
+            size = _overlap(words, other_words)
+            if size:
+                start = list(_TOKEN_RE.finditer(text))[len(words) - size].start()
+                text = text[:start].strip()
+                words = words[:len(words) - size]
+                stats["trimmed"] += 1
+        if text:
+            kept.append((chunk._replace(text=text), words, shingles))
+    return [chunk for chunk, _, _ in kept], stats
+
+
+def render_chunk(number: int, chunk: ContextChunk) -> str:
+    return f"[{number}] {SOURCE_MARKER.format(source=chunk.source)}\n{chunk.text}"
+
+
+def pack_context(query: str, retrieved: Dict[str, Iterable[Any]],
+                 budget: Optional[int] = None) -> PackedContext:
+    """
+    Builds the prompt context from {corpus: retrieval contexts}: chunks are
+    reranked across corpora, deduplicated and added best first while they
+    fit in `budget` tokens (CONTEXT_TOKEN_BUDGET by default). A chunk that
+    does not fit is skipped so smaller, lower ranked ones can still be used.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    candidates = [chunk for corpus, contexts in retrieved.items() for chunk in chunks_from_contexts(corpus, contexts)]
+    chunks, stats = deduplicate(rerank(query, candidates))
+    selected, parts, tokens, dropped = [], [], 0, 0
+    for chunk in chunks:
+        part = render_chunk(len(selected) + 1, chunk)
+        part_tokens = count_tokens(part)
+        if tokens + part_tokens > budget:
+            dropped += 1
+            continue
+        selected.append(chunk)
+        parts.append(part)
+        tokens += part_tokens
+    stats.update({"candidates": len(candidates), "over_budget": dropped, "selected": len(selected),
+                  "tokens": tokens, "budget": budget})
+    logging.info(f"Packed {len(selected)} of {len(candidates)} retrieved chunks into {tokens} tokens "
+                 f"({stats['duplicates']} duplicates, {dropped} over budget)")
+    return PackedContext("\n\n".join(parts), selected, stats)
@@ -0,0 +1,160 @@
+import os
+import re
+import json
+import math
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+# Per-corpus term statistics, kept next to corpus_registry.json
+CORPUS_PROFILES_FILE = os.environ.get("CORPUS_PROFILES_FILE", "corpus_profiles.json")
+# Terms kept per corpus profile; the rarest are dropped beyond this
+PROFILE_MAX_TERMS = int(os.environ.get("PROFILE_MAX_TERMS", 20000))
+# A corpus' display name and description count as this many documents containing their terms
+DESCRIPTION_WEIGHT = 5
+# Corpora scoring at least this share of the best score are searched as well
+ROUTER_RELATIVE_THRESHOLD = float(os.environ.get("ROUTER_RELATIVE_THRESHOLD", 0.5))
+# A best score below this leaves the decision to the fallback classifier
+ROUTER_MIN_SCORE = float(os.environ.get("ROUTER_MIN_SCORE", 0.5))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"[^\W\d_]\w+", re.UNICODE)
+_STOPWORDS = frozenset("""
+about after again all also and any are because been before being between both but can could did does
+doing down during each few for from further had has have having her here hers him his how into its
+just more most not now off once only other our out over own same she should some such than that the
+their them then there these they this those through too under until very was were what when where
+which while who whom why will with would you your yours
+""".split())
+
+
+def profile_terms(text: str) -> Set[str]:
+    """Distinct lowercase terms of a text, without stopwords, numbers and one- or two-letter words."""
+    return {term for term in _WORD_RE.findall(text.lower()) if len(term) > 2 and term not in _STOPWORDS}
+
+
+class ProfileBuilder:
+    """Collects document frequencies for a corpus during an ingestion."""
+
+    def __init__(self):
+        self.documents = 0
+        self.df: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, text: str) -> None:
+        terms = profile_terms(text)
+        with self._lock:
+            self.documents += 1
+            self.df.update(terms)
+
+
+class Route(NamedTuple):
+    corpora: List[str]
+    scores: Dict[str, float]
+    ambiguous: bool
+
+
+class CorpusRouter:
+    """
+    Picks the corpora relevant to a query without a model call. Each corpus
+    has a profile of how many of its documents contain each term, built
+    while documents are ingested, plus the terms of its name and
+    description. A query is scored against every profile with BM25, taking
+    each corpus as one document whose term frequencies are document
+    frequencies and whose length is its document count. The corpora within
+    ROUTER_RELATIVE_THRESHOLD of the best score are chosen.
+
+    Profiles only grow: a changed document is counted again on
+    re-ingestion. They are statistics for routing, not an index.
+    """
+
+    def __init__(self, path: str = CORPUS_PROFILES_FILE):
+        self.path = path
+        self._profiles: Optional[Dict[str, dict]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, dict]:
+        """Returns the profiles, reading the file on first use. Caller holds the lock."""
+        if self._profiles is None:
+            self._profiles = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._profiles = json.load(f)
+                except Exception as e:
+                    logging.error(f"Could not load corpus profiles from {self.path}: {e}")
+        return self._profiles
+
+    def _save(self) -> None:
+        """Writes the profiles. Caller holds the lock."""
+        try:
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(self._profiles, f)
+            os.replace(f"{self.path}.tmp", self.path)
+        except Exception as e:
+            logging.error(f"Could not save corpus profiles to {self.path}: {e}")
+
+    def _profile(self, corpus_name: str) -> dict:
+        return self._load().setdefault(corpus_name, {"documents": 0, "df": {}, "description_terms": []})
+
+    def update(self, corpus_name: str, builder: ProfileBuilder) -> None:
+        """Adds the documents collected by `builder` to the corpus profile."""
+        if not builder.documents:
+            return
+        with self._lock:
+            profile = self._profile(corpus_name)
+            df = Counter(profile["df"])
+            df.update(builder.df)
+            profile["df"] = dict(df.most_common(PROFILE_MAX_TERMS))
+            profile["documents"] += builder.documents
+            self._save()
+        logging.info(f"Corpus profile of {corpus_name} updated with {builder.documents} documents")
+
+    def describe(self, corpus_name: str, display_name: str, description: str) -> None:
+        with self._lock:
+            self._profile(corpus_name)["description_terms"] = sorted(profile_terms(f"{display_name} {description}"))
+            self._save()
+
+    def remove(self, corpus_name: str) -> None:
+        with self._lock:
+            if self._load().pop(corpus_name, None) is not None:
+                self._save()
+
+    def route(self, query: str, corpora: Iterable[str]) -> Route:
+        """
+        Scores `corpora` for the query. The route is ambiguous when no
+        corpus reaches ROUTER_MIN_SCORE or when one of them has no profile
+        yet (e.g. it was created before profiles existed).
+        """
+        corpora = list(corpora)
+        terms = profile_terms(query)
+        with self._lock:
+            profiles = {name: self._load().get(name) for name in corpora}
+            missing = [name for name, profile in profiles.items() if not profile]
+            profiled = {name: profile for name, profile in profiles.items() if profile}
+            sizes = {name: profile["documents"] + DESCRIPTION_WEIGHT for name, profile in profiled.items()}
+            average_size = sum(sizes.values()) / len(sizes) if sizes else 1.0
+            scores = dict.fromkeys(profiled, 0.0)
+            for term in terms:
+                counts = {}
+                for name, profile in profiled.items():
+                    count = profile["df"].get(term, 0)
+                    if term in profile["description_terms"]:
+                        count += DESCRIPTION_WEIGHT
+                    if count:
+                        counts[name] = count
+                if not counts:
+                    continue
+                idf = math.log(1 + (len(corpora) - len(counts) + 0.5) / (len(counts) + 0.5))
+                for name, count in counts.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * sizes[name] / average_size)
+                    scores[name] += idf * count * (BM25_K1 + 1) / (count + norm)
+
+        best = max(scores.values(), default=0.0)
+        chosen = sorted((name for name, score in scores.items() if score and score >= ROUTER_RELATIVE_THRESHOLD * best),
+                        key=lambda name: scores[name], reverse=True)
+        rounded = {name: round(score, 3) for name, score in scores.items()}
+        return Route(chosen, rounded, bool(missing) or best < ROUTER_MIN_SCORE)
+
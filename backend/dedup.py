@@ -0,0 +1,104 @@
+import os
+import re
+import hashlib
+from typing import Dict, List, Optional
+
+# Maximum Hamming distance between two 64-bit SimHashes for the pages to be
+# considered near-duplicates. Set to -1 to only drop exact copies.
+DEDUP_SIMHASH_THRESHOLD = int(os.environ.get("DEDUP_SIMHASH_THRESHOLD", 6))
+# Pages with fewer words than this are only compared by exact hash; SimHash
+# is too noisy on very short texts.
+DEDUP_MIN_WORDS = int(os.environ.get("DEDUP_MIN_WORDS", 50))
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def exact_hash(text: str) -> str:
+    """Hash of the whitespace-normalized text."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def simhash(words: List[str]) -> int:
+    """64-bit SimHash over word shingles."""
+    weights = [0] * SIMHASH_BITS
+    if len(words) < SHINGLE_SIZE:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    for shingle in shingles:
+        h = _hash64(shingle)
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class NearDuplicateFilter:
+    """
+    Streaming duplicate detector. Pages are checked one at a time against
+    everything accepted before: first by exact content hash, then by SimHash
+    distance. Candidate lookups use band indexes (threshold + 1 bands, so by
+    the pigeonhole principle any match within the threshold shares a band),
+    which keeps each check close to O(1) instead of scanning every page.
+    """
+
+    def __init__(self, threshold: int = DEDUP_SIMHASH_THRESHOLD, min_words: int = DEDUP_MIN_WORDS):
+        self.threshold = min(threshold, SIMHASH_BITS // 4 - 1)
+        self.min_words = min_words
+        self._exact: Dict[str, str] = {}
+        self._fingerprints: Dict[str, int] = {}
+        self._bands: List[Dict[int, List[str]]] = [{} for _ in range(max(self.threshold + 1, 0))]
+        self.stats = {"pages_removed": 0, "bytes_removed": 0, "exact_duplicates": 0, "near_duplicates": 0}
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        count = len(self._bands)
+        width = SIMHASH_BITS // count
+        return [(fingerprint >> (i * width)) & ((1 << width) - 1) for i in range(count)]
+
+    def check(self, key: str, text: str) -> Optional[str]:
+        """
+        Returns the key of an earlier page that `text` duplicates, or None
+        after registering the page as a new original.
+        """
+        digest = exact_hash(text)
+        original = self._exact.get(digest)
+        if original is not None:
+            self._record_removal(text, "exact_duplicates")
+            return original
+
+        words = _WORD_RE.findall(text.lower())
+        fingerprint = None
+        if self._bands and len(words) >= self.min_words:
+            fingerprint = simhash(words)
+            band_keys = self._band_keys(fingerprint)
+            for band, band_key in zip(self._bands, band_keys):
+                for candidate in band.get(band_key, ()):
+                    if bin(fingerprint ^ self._fingerprints[candidate]).count("1") <= self.threshold:
+                        self._record_removal(text, "near_duplicates")
+                        return candidate
+
+        self._exact[digest] = key
+        if fingerprint is not None:
+            self._fingerprints[key] = fingerprint
+            for band, band_key in zip(self._bands, band_keys):
+                band.setdefault(band_key, []).append(key)
+        return None
+
+    def seed_exact(self, key: str, digest: str) -> None:
+        """Registers the exact hash of a page accepted in an earlier run."""
+        self._exact.setdefault(digest, key)
+
+    def _record_removal(self, text: str, kind: str) -> None:
+        self.stats["pages_removed"] += 1
+        self.stats["bytes_removed"] += len(text.encode("utf-8"))
+        self.stats[kind] += 1
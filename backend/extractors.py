@@ -0,0 +1,258 @@
+import os
+import io
+import logging
+import zipfile
+import multiprocessing
+from xml.etree import ElementTree
+import PyPDF2
+import openpyxl
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple, Union
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Extraction runs in worker processes so CPU-bound parsing uses every core
+# and a pathological file cannot stall or crash the request. 0 workers
+# extracts in-process instead.
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", os.cpu_count() or 1))
+# Seconds one file may take before its worker is killed
+EXTRACTION_TIMEOUT = float(os.environ.get("EXTRACTION_TIMEOUT", 120))
+# Extra address space a worker may allocate, in MB
+EXTRACTION_MEMORY_LIMIT_MB = int(os.environ.get("EXTRACTION_MEMORY_LIMIT_MB", 1024))
+# Workers are replaced after this many files so leaks in the parsers don't pile up
+EXTRACTION_TASKS_PER_CHILD = 20
+# "forkserver" forks workers from a small single-threaded server process with
+# this module preloaded; forking the multithreaded app itself can deadlock a
+# worker on a lock another thread held. Workers still import the __main__
+# script, which is why the app is started through server.py.
+EXTRACTION_START_METHOD = os.environ.get("EXTRACTION_START_METHOD", "forkserver")
+# Longest text kept from one file; 0 keeps everything
+EXTRACTION_MAX_CHARS = int(os.environ.get("EXTRACTION_MAX_CHARS", 20_000_000))
+# Characters read per block from plain-text files
+TEXT_BLOCK_SIZE = 1024 * 1024
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DOCX_PARAGRAPH = f"{_W}p"
+DOCX_TEXT = f"{_W}t"
+DOCX_TAB = f"{_W}tab"
+DOCX_BREAK = f"{_W}br"
+
+
+def _open(source: Union[bytes, BinaryIO]) -> BinaryIO:
+    """Wraps raw bytes in a buffer; file objects are used as they are."""
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+
+def iter_pdf_text(source: Union[bytes, BinaryIO], filename: str = "") -> Iterator[str]:
+    """Yields the text of a PDF one page at a time; unreadable pages are skipped."""
+    reader = PyPDF2.PdfReader(_open(source))
+    for number in range(len(reader.pages)):
+        try:
+            text = reader.pages[number].extract_text()
+        except Exception as e:
+            logging.warning(f"Skipping page {number + 1} of {filename}: {e}")
+            continue
+        if text:
+            yield text
+
+
+def iter_docx_text(source: Union[bytes, BinaryIO], filename: str = "") -> Iterator[str]:
+    """Yields the paragraphs of a DOCX document, parsing its XML incrementally."""
+    with zipfile.ZipFile(_open(source)) as archive, archive.open("word/document.xml") as document:
+        for _, element in ElementTree.iterparse(document, events=("end",)):
+            if element.tag != DOCX_PARAGRAPH:
+                continue
+            parts = []
+            for node in element.iter():
+                if node.tag == DOCX_TEXT and node.text:
+                    parts.append(node.text)
+                elif node.tag == DOCX_TAB:
+                    parts.append("\t")
+                elif node.tag == DOCX_BREAK:
+                    parts.append("\n")
+            element.clear()
+            text = "".join(parts)
+            if text.strip():
+                yield text
+
+
+def iter_xlsx_text(source: Union[bytes, BinaryIO], filename: str = "") -> Iterator[str]:
+    """Yields a heading per sheet and then its rows, reading the workbook in read-only streaming mode."""
+    workbook = openpyxl.load_workbook(_open(source), read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield f"## {sheet.title}"
+            for row in sheet.iter_rows(values_only=True):
+                row_text = [str(cell) for cell in row if cell is not None]
+                if row_text:
+                    yield " | ".join(row_text)
+    finally:
+        workbook.close()
+
+
+def iter_txt_text(source: Union[bytes, BinaryIO], filename: str = "") -> Iterator[str]:
+    """Yields a text file in blocks of lines, decoding incrementally."""
+    stream = io.TextIOWrapper(_open(source), encoding="utf-8", errors="replace", newline="")
+    try:
+        while True:
+            lines = stream.readlines(TEXT_BLOCK_SIZE)
+            if not lines:
+                break
+            yield "".join(lines).rstrip("\n")
+    finally:
+        stream.detach()
+
+
+EXTRACTORS = {
+    ".pdf": iter_pdf_text,
+    ".docx": iter_docx_text,
+    ".xlsx": iter_xlsx_text,
+    ".txt": iter_txt_text,
+}
+
+
+def iter_text_from_file(source: Union[bytes, BinaryIO], filename: str) -> Iterator[str]:
+    """
+    Streams the text of a file as pieces (pages, paragraphs, rows), from
+    raw bytes or a binary file object, without writing temporary files.
+    Unsupported formats yield nothing.
+    """
+    ext = os.path.splitext(filename.lower())[1]
+    extractor = EXTRACTORS.get(ext)
+    if extractor is None:
+        if ext in (".doc", ".xls"):
+            logging.warning(f"{ext.upper()[1:]} parsing not supported: {filename}")
+        else:
+            logging.warning(f"Unsupported file format for {filename}")
+        return iter(())
+    return extractor(source, filename)
+
+
+def extract_text_from_file(file_bytes: Union[bytes, BinaryIO], filename: str) -> str:
+    """
+    Text of a file, joined from iter_text_from_file. Stops at
+    EXTRACTION_MAX_CHARS characters. Parse errors (and MemoryError) are
+    raised, so callers can report the file instead of indexing nothing.
+    """
+    text = io.StringIO()
+    size = 0
+    for piece in iter_text_from_file(file_bytes, filename):
+        if size:
+            text.write("\n")
+        text.write(piece)
+        size += len(piece) + 1
+        if EXTRACTION_MAX_CHARS and size >= EXTRACTION_MAX_CHARS:
+            logging.warning(f"Truncated {filename} at {EXTRACTION_MAX_CHARS} characters")
+            break
+    return text.getvalue()[:EXTRACTION_MAX_CHARS or None]
+
+
+def _current_address_space() -> int:
+    """Virtual memory size of this process in bytes, or 0 if unknown."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmSize:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _limit_memory(limit_mb: int) -> None:
+    """Worker initializer: caps how much more memory the worker may map."""
+    if resource is None or limit_mb <= 0:
+        return
+    # A forked worker already maps its parent's address space; the limit is on top of that
+    limit = _current_address_space() + limit_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        logging.warning(f"Could not limit extraction worker memory: {e}")
+
+
+def _extract_worker(source: Union[bytes, str], filename: str) -> Tuple[str, Optional[str]]:
+    """Extracts one file given as bytes or as the path of a spooled upload."""
+    try:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                return extract_text_from_file(f, filename), None
+        return extract_text_from_file(source, filename), None
+    except MemoryError:
+        return "", f"{filename} exceeded the extraction memory limit"
+    except Exception as e:
+        return "", f"Error extracting {filename}: {e}"
+
+
+def _start_context():
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(EXTRACTION_START_METHOD if EXTRACTION_START_METHOD in methods else None)
+    if context.get_start_method() == "forkserver":
+        # Only takes effect when the server starts, i.e. for the first pool
+        context.set_forkserver_preload(["extractors"])
+    return context
+
+
+def extract_texts(files: List[Tuple[str, Union[bytes, str]]], workers: int = EXTRACTION_WORKERS,
+                  timeout: float = EXTRACTION_TIMEOUT, memory_limit_mb: int = EXTRACTION_MEMORY_LIMIT_MB,
+                  on_result: Optional[Callable[[str], None]] = None) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Extracts text from (filename, bytes or file path) pairs on a process
+    pool and returns (filename, text, error) in input order. Workers open
+    paths themselves, so spooled uploads are never copied between
+    processes. A file that runs past `timeout` seconds, exhausts its
+    worker's memory limit or kills its worker gets an error and empty text;
+    the pool is then restarted for the remaining files. `on_result(filename)` is called as each file completes, in order,
+    and may raise to abort the batch.
+    """
+    if workers <= 0:
+        results = []
+        for filename, source in files:
+            text, error = _extract_worker(source, filename)
+            if error:
+                logging.error(error)
+            results.append((filename, text, error))
+            if on_result:
+                on_result(filename)
+        return results
+
+    results: List[Optional[Tuple[str, str, Optional[str]]]] = [None] * len(files)
+    pending = list(range(len(files)))
+    context = _start_context()
+    while pending:
+        pool = context.Pool(processes=min(workers, len(pending)), initializer=_limit_memory,
+                            initargs=(memory_limit_mb,), maxtasksperchild=EXTRACTION_TASKS_PER_CHILD)
+        try:
+            tasks = {i: pool.apply_async(_extract_worker, (files[i][1], files[i][0])) for i in pending}
+            timed_out = None
+            for i in pending:
+                filename = files[i][0]
+                # Tasks start in order, so by the time earlier ones are done this one is running
+                try:
+                    text, error = tasks[i].get(timeout=timeout)
+                except multiprocessing.TimeoutError:
+                    text, error = "", f"Extracting {filename} timed out after {timeout:.0f}s or crashed its worker"
+                    timed_out = i
+                if error:
+                    logging.error(error)
+                results[i] = (filename, text, error)
+                if on_result:
+                    on_result(filename)
+                if timed_out is not None:
+                    break
+            if timed_out is None:
+                break
+            # The stuck worker can only be stopped with the pool; keep what finished meanwhile
+            for j in pending:
+                if results[j] is None and tasks[j].ready():
+                    text, error = tasks[j].get()
+                    results[j] = (files[j][0], text, error)
+                    if on_result:
+                        on_result(files[j][0])
+            pending = [j for j in pending if results[j] is None]
+        finally:
+            pool.terminate()
+            pool.join()
+    return results
@@ -0,0 +1,194 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+# Ingestion jobs running at once; the rest wait in the queue
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Job records live in JOB_DIR, or under JOB_PREFIX in the bucket
+JOB_DIR = os.environ.get("JOB_DIR", ".jobs")
+JOB_PREFIX = "jobs/"
+# Seconds between progress writes of a running job
+JOB_SAVE_INTERVAL = float(os.environ.get("JOB_SAVE_INTERVAL", 2.0))
+
+ACTIVE_STATES = ("queued", "running")
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once cancellation was requested."""
+
+
+class Job:
+    """
+    One background ingestion. The job function reports progress through
+    increment() and track(), and reaches cancellation points there as well:
+    once cancel() was called, the next one raises JobCancelled.
+    """
+
+    def __init__(self, store, kind: str, params: Optional[dict] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.status = "queued"
+        self.progress: Dict[str, int] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._store = store
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._last_save = 0.0
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "params": self.params,
+                "status": self.status,
+                "cancel_requested": self._cancel.is_set(),
+                "progress": dict(self.progress),
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+    def save(self) -> None:
+        with self._save_lock:
+            try:
+                self._store.save(self.id, self.to_dict())
+            except Exception as e:
+                logging.error(f"Could not save job {self.id}: {e}")
+            self._last_save = time.monotonic()
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.progress[name] = self.progress.get(name, 0) + amount
+        if time.monotonic() - self._last_save >= JOB_SAVE_INTERVAL:
+            self.save()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def step(self, name: str) -> None:
+        """Counts one unit of work under `name`; a cancellation point."""
+        self.check_cancelled()
+        self.increment(name)
+
+    def track(self, items: Iterable, name: str) -> Iterator:
+        """Yields items, counting each under `name` and stopping once the job is cancelled."""
+        for item in items:
+            self.step(name)
+            yield item
+
+
+class JobManager:
+    """
+    Runs ingestion jobs on a small thread pool so requests return at once.
+    Job records are kept in `store` (any object with load/save/delete by
+    id, such as the crawl checkpoint stores) and stay readable after the
+    job finished or the process restarted. A job that was queued or running
+    when the process stopped is reported as "interrupted".
+    """
+
+    def __init__(self, store, workers: int = JOB_WORKERS):
+        self.store = store
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, kind: str, fn: Callable[[Job], Tuple[dict, int]], params: Optional[dict] = None,
+               cleanup: Optional[Callable[[], None]] = None) -> Job:
+        """
+        Queues fn(job). It returns (response body, HTTP status) as the
+        endpoint would have; a status of 400 or above fails the job.
+        `cleanup()` runs once the job ends, even if it never started.
+        """
+        job = Job(self.store, kind, params)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.save()
+        self._executor.submit(self._run, job, fn, cleanup)
+        logging.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def _run(self, job: Job, fn: Callable[[Job], Tuple[dict, int]], cleanup: Optional[Callable[[], None]]) -> None:
+        if job.cancelled:
+            job.status = "cancelled"
+        else:
+            job.status = "running"
+            job.started_at = time.time()
+            job.save()
+            try:
+                body, status_code = fn(job)
+                job.result = body
+                if status_code >= 400:
+                    job.status = "failed"
+                    job.error = body.get("error")
+                else:
+                    job.status = "succeeded"
+            except JobCancelled:
+                job.status = "cancelled"
+            except Exception as e:
+                logging.exception(f"Job {job.id} failed")
+                job.status = "failed"
+                job.error = str(e)
+        if cleanup:
+            try:
+                cleanup()
+            except Exception as e:
+                logging.error(f"Cleanup of job {job.id} failed: {e}")
+        job.finished_at = time.time()
+        job.save()
+        logging.info(f"{job.kind} job {job.id} {job.status}")
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job:
+            return job.to_dict()
+        record = self.store.load(job_id)
+        if record and record["status"] in ACTIVE_STATES:
+            record["status"] = "interrupted"
+            record["error"] = "The server restarted before the job finished."
+        return record
+
+    def is_active(self, job_id: str) -> bool:
+        """Whether the job's record says it is queued or running, here or in another process."""
+        with self._lock:
+            if job_id in self._jobs:
+                return True
+        try:
+            record = self.store.load(job_id)
+        except Exception as e:
+            logging.error(f"Could not load job {job_id}: {e}")
+            return True
+        return bool(record) and record["status"] in ACTIVE_STATES
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """Requests cancellation; returns the job record, or None if the job is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job:
+            job.cancel()
+            logging.info(f"Cancellation requested for job {job_id}")
+            return job.to_dict()
+        return self.get(job_id)
@@ -1,24 +1,38 @@
 import os
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 import json
+import hashlib
+import itertools
+import threading
 
 # IMPORTS from your existing code
-from scraper import scrape_documentation
+from scraper import iter_documentation, DISCOVERY_MODES, CrawlCheckpoint, LocalCheckpointStore
+from page_cache import PageCache
+from chunking import chunking_params
+from jobs import JobManager, JOB_DIR, JOB_PREFIX
+from snapshot import ScrapedDataSnapshot
+from uploads import SpoolingRequest, remove_uploads, MAX_CONTENT_LENGTH
 from utils import (
     setup_logging,
-    save_scraped_data_to_gcs,
-    load_scraped_data_from_gcs,
     create_rag_corpus,
-    import_files_to_corpus,
     generate_rag_response,
+    stream_rag_response,
     load_corpus_registry,
     save_corpus_registry,
     handle_new_documentation,
-    extract_text_from_file,
-    cleanup_gcs_bucket_parallel,
+    ingest_documents,
+    ingestion_summary,
+    CorpusManifest,
+    corpus_router,
+    corpus_changed,
+    answer_cache,
+    retrieval_cache,
+    GCSCheckpointStore,
+    extract_texts,
+    cleanup_stale_staging,
     GCS_BUCKET_NAME
 )
 from conversation_store import (
@@ -33,21 +47,95 @@ from vertexai.preview import rag
 load_dotenv()
 
 app = Flask(__name__)
+# Large uploads are spooled to disk rather than held in memory, see uploads.py
+app.request_class = SpoolingRequest
+app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
 CORS(app)
 setup_logging()
 
-DATA_FILE_NAME = "scraped_data.json"
+# Where crawl checkpoints and job records are kept: "local" disk or the "gcs" bucket.
+# Defaults to the bucket when one is configured, since Cloud Run's disk does not outlive the instance
+CRAWL_CHECKPOINT_STORE = os.environ.get("CRAWL_CHECKPOINT_STORE", "gcs" if os.environ.get("GCS_BUCKET_NAME") else "local")
 PROJECT_ID = os.environ.get("PROJECT_ID", "your-project-id")
 LOCATION = os.environ.get("LOCATION", "us-central1")
 
 logging.info(f"GCS_BUCKET_NAME: {GCS_BUCKET_NAME}")
 
-scraped_data = {}
-# If you want to load previously scraped data from GCS
-if GCS_BUCKET_NAME:
-    scraped_data = load_scraped_data_from_gcs(GCS_BUCKET_NAME, DATA_FILE_NAME)
-    if scraped_data:
-        logging.info("Scraped data is available")
+# Conditional-GET cache shared by every crawl, see page_cache.py
+page_cache = PageCache()
+checkpoint_store = GCSCheckpointStore() if CRAWL_CHECKPOINT_STORE == "gcs" else LocalCheckpointStore()
+# Scrape and upload requests run as background jobs, see jobs.py
+jobs = JobManager(GCSCheckpointStore(prefix=JOB_PREFIX) if CRAWL_CHECKPOINT_STORE == "gcs"
+                  else LocalCheckpointStore(JOB_DIR))
+
+
+def extract_uploaded_files(files, job):
+    """
+    Extracts claimed uploads on the extraction process pool.
+    Returns {filename: text} for files with text, in upload order, and the
+    per-file extraction errors.
+    """
+    file_texts = {}
+    errors = []
+    for filename, parsed_text, error in extract_texts(files, on_result=lambda _: job.step("files_read")):
+        if error:
+            errors.append({"file": filename, "error": error})
+        elif parsed_text.strip():
+            file_texts[filename] = parsed_text
+    return file_texts, errors
+
+
+def job_accepted(job):
+    """Response for an endpoint that queued a background job."""
+    return jsonify({"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"}), 202
+
+
+def chunking_options(data):
+    """Chunk parameters given in a request, or None to keep the corpus' own; raises ValueError if invalid."""
+    chunk_size = data.get("chunk_size") or None
+    chunk_overlap = data.get("chunk_overlap")
+    if chunk_overlap == "":
+        chunk_overlap = None
+    if chunk_size is None and chunk_overlap is None:
+        return None
+    return chunking_params(chunk_size, chunk_overlap)
+
+
+def sse_event(event, data):
+    """One server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """Streams server-sent events without buffering by Flask or a proxy in front of it."""
+    return Response(stream_with_context(events), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def conversation_query(conv, user_message):
+    """The RAG query for a new message: the whole conversation so far followed by the message."""
+    conversation_context = ""
+    for m in conv["messages"]:
+        if m["role"] == "user":
+            conversation_context += f"\nUser: {m['content']}"
+        else:
+            conversation_context += f"\nAssistant: {m['content']}"
+
+    return (
+        f"Conversation so far:\n{conversation_context}\n"
+        f"New user query: {user_message}\n"
+        "Please respond as a helpful documentation assistant, using relevant docs if available."
+    )
+
+
+def crawl_checkpoint(target, base_url, resume):
+    """Checkpoint for crawling base_url into target; the id is stable so a later request can resume it."""
+    crawl_id = hashlib.sha1(f"{target}|{base_url}".encode("utf-8")).hexdigest()
+    return CrawlCheckpoint(checkpoint_store, crawl_id, resume=resume)
+
+
+# Previously scraped pages; sharded and only read when used, so cold starts don't load them
+scraped_data = ScrapedDataSnapshot()
 
 # Load corpus registry from local JSON
 load_corpus_registry()
@@ -60,40 +148,77 @@ load_corpus_registry()
 def scrape():
     """
     Scrape a base_url and create a NEW RAG corpus with the given display_name & description.
+    Optional "chunk_size" / "chunk_overlap" set the corpus' chunk parameters.
     """
     data = request.get_json()
     base_url = data.get("base_url")
     max_pages = data.get("max_pages", 100)
     display_name = data.get("display_name")
     description = data.get("description")
+    discovery = data.get("discovery", "links")
+    resume = data.get("resume", False)
+    sync = data.get("sync", False)
 
     if not base_url or not display_name or not description:
         return jsonify({"error": "base_url, display_name and description are required"}), 400
+    if data.get("incremental"):
+        return jsonify({"error": "incremental only applies to an existing corpus, "
+                                 "use /rag_corpora/<corpus_name>/scrape"}), 400
+    if discovery not in DISCOVERY_MODES:
+        return jsonify({"error": f"discovery must be one of {', '.join(DISCOVERY_MODES)}"}), 400
+    try:
+        chunking = chunking_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def run(job):
+        logging.info(f"Starting scraping of {base_url}")
+
+        # Crawl lazily
+        checkpoint = crawl_checkpoint(display_name, base_url, resume)
+        fetch_errors = []
+        pages = job.track(iter_documentation(base_url, max_pages=max_pages, cache=page_cache,
+                                             discovery=discovery, checkpoint=checkpoint,
+                                             on_failed=fetch_errors.append),
+                          "pages_crawled")
+        first_page = next(pages, None)
+        if first_page is None:
+            checkpoint.clear()
+            if checkpoint.resumed:
+                return {"message": "The resumed crawl had no pages left to scrape."}, 200
+            return {"error": "Could not scrape the provided base url"}, 400
+
+        # Create new corpus and stream pages into it while the crawl continues;
+        # new or changed pages are appended to the scraped data snapshot as they arrive
+        snapshot_writer = scraped_data.writer()
+        try:
+            response = handle_new_documentation(base_url, display_name, description,
+                                                itertools.chain([first_page], pages),
+                                                on_document=snapshot_writer.add,
+                                                on_imported=checkpoint.mark_done,
+                                                known_hashes=checkpoint.page_hashes(),
+                                                sync=sync, chunking=chunking, on_progress=job.increment,
+                                                fetch_errors=fetch_errors, job_id=job.id,
+                                                check_cancelled=job.check_cancelled)
+        finally:
+            snapshot_writer.close()
+
+        if response["status"] == "OK":
+            logging.info("Documents imported to RAG Corpus")
+            # Keep the checkpoint while files failed so a resumed crawl can retry them
+            if not response["ingestion"]["failed"]:
+                checkpoint.clear()
+            save_corpus_registry()
+            return {
+                "message": "Scraping completed, data indexed with Vertex AI RAG.",
+                "corpus_name": response["corpus_name"],
+                "ingestion": response["ingestion"]
+            }, 200
+        else:
+            return {"error": "Could not index the documentation.",
+                    "ingestion": response.get("ingestion")}, 400
 
-    logging.info(f"Starting scraping of {base_url}")
-    global scraped_data
-
-    # Perform scraping
-    scraped_data = scrape_documentation(base_url, max_pages=max_pages)
-    if not scraped_data:
-        return jsonify({"error": "Could not scrape the provided base url"}), 400
-
-    # Optionally save the scraped data
-    if GCS_BUCKET_NAME:
-        save_scraped_data_to_gcs(scraped_data, GCS_BUCKET_NAME, DATA_FILE_NAME)
-
-    # Create new corpus and import data
-    response = handle_new_documentation(base_url, display_name, description, scraped_data)
-
-    if response["status"] == "OK":
-        logging.info("Documents imported to RAG Corpus")
-        save_corpus_registry()
-        return jsonify({
-            "message": "Scraping completed, data indexed with Vertex AI RAG.",
-            "corpus_name": response["corpus_name"]
-        }), 200
-    else:
-        return jsonify({"error": "Could not index the documentation."}), 400
+    return job_accepted(jobs.submit("scrape", run, {"base_url": base_url, "display_name": display_name}))
 
 
 ###################################
@@ -105,20 +230,36 @@ def scrape_to_existing_corpus(corpus_name):
     """
     Scrapes a website and imports that data into an EXISTING corpus.
     JSON body:
-      { "base_url": "...", "max_pages": 100 }
-
-    1. Scrape up to max_pages from base_url
-    2. Convert each page to .txt
-    3. Upload those .txt files to GCS
-    4. import_files_to_corpus(corpus_name=...)
-    5. Cleanup
+      { "base_url": "...", "max_pages": 100, "incremental": false, "discovery": "links", "resume": false,
+        "sync": false, "chunk_size": 512, "chunk_overlap": 100 }
+
+    chunk_size / chunk_overlap are optional and replace the corpus' chunk
+    parameters for this and later ingestions. Pages whose content is already
+    in the corpus, according to its manifest, are skipped and changed pages
+    replace their old version; "incremental" is accepted but always on, since
+    a page only counts as indexed once its import succeeded. With "sync",
+    pages that are no longer found are also removed from the corpus. Pages
+    answer 404 / 410 when they are gone; if any other page could not be
+    fetched, nothing is removed.
+
+    Pages are uploaded to GCS and imported while the crawl is still running,
+    see utils.ingest_documents.
     """
     data = request.get_json()
     base_url = data.get("base_url")
     max_pages = data.get("max_pages", 100)
+    discovery = data.get("discovery", "links")
+    resume = data.get("resume", False)
+    sync = data.get("sync", False)
 
     if not base_url:
         return jsonify({"error": "base_url is required"}), 400
+    if discovery not in DISCOVERY_MODES:
+        return jsonify({"error": f"discovery must be one of {', '.join(DISCOVERY_MODES)}"}), 400
+    try:
+        chunking = chunking_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # Check if the corpus actually exists
     try:
@@ -128,50 +269,46 @@ def scrape_to_existing_corpus(corpus_name):
     except Exception as e:
         return jsonify({"error": f"Error retrieving corpus: {e}"}), 404
 
-    # 1. Scrape
-    logging.info(f"Scraping {base_url} for existing corpus {corpus_name} ...")
-    new_data = scrape_documentation(base_url, max_pages)
-    if not new_data:
-        return jsonify({"error": "No data scraped from that base URL."}), 400
-
-    # 2. Convert and upload to GCS
-    import tempfile, os
-    paths = []
-    gcs_paths = []
-    from utils import upload_to_gcs
-
-    try:
-        # Each key in new_data is a URL, each value is the text
-        for url, text in new_data.items():
-            if not isinstance(text, str) or not text.strip():
-                continue
-            with tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False, encoding="utf-8") as tmp_file:
-                tmp_file.write(text)
-                tmp_file_path = tmp_file.name
-                paths.append(tmp_file_path)
-
-            gcs_path = f"gs://{GCS_BUCKET_NAME}/{os.path.basename(tmp_file_path)}"
-            upload_to_gcs(GCS_BUCKET_NAME, os.path.basename(tmp_file_path), text, content_type="text/plain")
-            gcs_paths.append(gcs_path)
-
-        if not gcs_paths:
-            return jsonify({"error": "Scraped pages produced no valid text."}), 400
-
-        # 3. import_files_to_corpus
-        batch_size = 25
-        for i in range(0, len(gcs_paths), batch_size):
-            batch = gcs_paths[i : i+batch_size]
-            import_files_to_corpus(corpus_name=corpus_name, paths=batch)
-
-    finally:
-        # 4. cleanup
-        for p in paths:
-            os.remove(p)
-        cleanup_gcs_bucket_parallel(GCS_BUCKET_NAME)
-
-    return jsonify({
-        "message": f"Successfully scraped {len(new_data)} pages and imported into corpus {corpus_name}."
-    }), 200
+    def run(job):
+        logging.info(f"Scraping {base_url} for existing corpus {corpus_name} ...")
+        checkpoint = crawl_checkpoint(corpus_name, base_url, resume)
+        fetch_errors = []
+        pages = job.track(iter_documentation(base_url, max_pages, cache=page_cache, discovery=discovery,
+                                             checkpoint=checkpoint, on_failed=fetch_errors.append),
+                          "pages_crawled")
+        first_page = next(pages, None)
+        if first_page is None:
+            checkpoint.clear()
+            if checkpoint.resumed:
+                return {"message": "The resumed crawl had no pages left to scrape."}, 200
+            return {"error": "No data scraped from that base URL."}, 400
+
+        snapshot_writer = scraped_data.writer()
+        try:
+            result = ingest_documents(corpus_name, itertools.chain([first_page], pages),
+                                      on_document=snapshot_writer.add,
+                                      on_imported=checkpoint.mark_done,
+                                      known_hashes=checkpoint.page_hashes(),
+                                      sync=sync, chunking=chunking, on_progress=job.increment,
+                                      fetch_errors=fetch_errors, job_id=job.id,
+                                      check_cancelled=job.check_cancelled)
+        finally:
+            snapshot_writer.close()
+        if not result["uploaded"] and not result["unchanged"]:
+            return {"error": "Scraped pages produced no valid text."}, 400
+        if result["uploaded"] and not result["imported"]:
+            return {"error": "None of the scraped pages could be imported.",
+                    "ingestion": ingestion_summary(result)}, 400
+        if not result["failed"]:
+            checkpoint.clear()
+
+        return {
+            "message": f"Successfully scraped {corpus_name}: {result['imported']} pages imported, "
+                       f"{result['unchanged']} unchanged, {result['deleted']} removed.",
+            "ingestion": ingestion_summary(result)
+        }, 200
+
+    return job_accepted(jobs.submit("scrape", run, {"base_url": base_url, "corpus_name": corpus_name}))
 
 
 #####################################
@@ -193,9 +330,36 @@ def chat():
         manual_corpora=selected_corpora
     )
     if rag_response["status"] == "OK":
-        return jsonify({"response": rag_response["response"]})
+        return jsonify({"response": rag_response["response"], "retrieval": rag_response.get("retrieval"),
+                        "context": rag_response.get("context"), "cache": rag_response.get("cache")})
     else:
-        return jsonify({"response": rag_response["response"]}), 400
+        return jsonify({"response": rag_response["response"], "retrieval": rag_response.get("retrieval")}), 400
+
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Streaming variant of /chat: server-sent "token" events carry the answer
+    as it is generated, followed by a "done" event with the full response
+    or an "error" event.
+    """
+    body = request.get_json()
+    query = body.get("query")
+    mode = body.get("mode", "auto")
+    selected_corpora = body.get("selected_corpora", [])
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+
+    def events():
+        for event, payload in stream_rag_response(query, mode=mode, manual_corpora=selected_corpora):
+            if event == "token":
+                yield sse_event("token", {"text": payload})
+            else:
+                yield sse_event(event, {"response": payload["response"], "retrieval": payload.get("retrieval"),
+                                        "context": payload.get("context"), "cache": payload.get("cache")})
+
+    return sse_response(events())
 
 
 #########################
@@ -242,24 +406,14 @@ def conversation_chat(conversation_id):
         return jsonify({"error": "Conversation not found"}), 404
 
     # Build entire chat context
-    all_messages = conv["messages"]
-    conversation_context = ""
-    for m in all_messages:
-        if m["role"] == "user":
-            conversation_context += f"\nUser: {m['content']}"
-        else:
-            conversation_context += f"\nAssistant: {m['content']}"
-
-    final_query = (
-        f"Conversation so far:\n{conversation_context}\n"
-        f"New user query: {user_message}\n"
-        "Please respond as a helpful documentation assistant, using relevant docs if available."
-    )
+    final_query = conversation_query(conv, user_message)
 
+    # The shared history makes different questions look alike, so only exact repeats hit the cache
     rag_response = generate_rag_response(
         query=final_query,
         mode=mode,
-        manual_corpora=selected_corpora
+        manual_corpora=selected_corpora,
+        similar_answers=False
     )
     if rag_response["status"] == "OK":
         assistant_reply = rag_response["response"]
@@ -269,6 +423,53 @@ def conversation_chat(conversation_id):
     conv = add_message_to_conversation(conversation_id, "assistant", assistant_reply)
     return jsonify(conv), 200
 
+@app.route("/conversations/<conversation_id>/chat/stream", methods=["POST"])
+def conversation_chat_stream(conversation_id):
+    """
+    Streaming variant of conversation_chat: answers with server-sent
+    "token" events as the reply is generated, then a "done" event with the
+    updated conversation (or "error"). The reply is stored once the
+    stream ends; if the client goes away first, the part generated so far
+    is stored.
+    """
+    data = request.get_json()
+    user_message = data.get("message")
+    mode = data.get("mode", "auto")
+    selected_corpora = data.get("selected_corpora", [])
+
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+
+    conv = add_message_to_conversation(conversation_id, "user", user_message)
+    if not conv:
+        return jsonify({"error": "Conversation not found"}), 404
+    final_query = conversation_query(conv, user_message)
+
+    def events():
+        parts = []
+        stored = False
+        try:
+            for event, payload in stream_rag_response(final_query, mode=mode, manual_corpora=selected_corpora,
+                                                      similar_answers=False):
+                if event == "token":
+                    parts.append(payload)
+                    yield sse_event("token", {"text": payload})
+                    continue
+                if event == "done":
+                    assistant_reply = payload["response"]
+                else:
+                    assistant_reply = "I encountered an error. Please try again later."
+                updated = add_message_to_conversation(conversation_id, "assistant", assistant_reply)
+                stored = True
+                yield sse_event(event, {"conversation": updated, "retrieval": payload.get("retrieval"),
+                                        "context": payload.get("context"), "cache": payload.get("cache")})
+        finally:
+            if not stored and parts:
+                logging.info(f"Stream of conversation {conversation_id} closed early, storing the partial reply")
+                add_message_to_conversation(conversation_id, "assistant", "".join(parts))
+
+    return sse_response(events())
+
 
 #################################
 # RAG Corpus Management
@@ -291,6 +492,9 @@ def list_rag_corpora():
 def delete_rag_corpus(corpus_name):
     try:
         rag.delete_corpus(corpus_name)
+        CorpusManifest(corpus_name).delete()
+        corpus_router.remove(corpus_name)
+        corpus_changed(corpus_name)
         return jsonify({"message": f"RAG corpus {corpus_name} deleted"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -303,36 +507,47 @@ def delete_rag_corpus(corpus_name):
 def upload():
     """
     Create a NEW corpus from uploaded documents.
-    form-data => display_name, description, files[]
+    form-data => display_name, description, files[], optional chunk_size / chunk_overlap
     """
     display_name = request.form.get("display_name")
     description = request.form.get("description")
     if not display_name or not description:
         return jsonify({"error": "display_name and description are required"}), 400
+    try:
+        chunking = chunking_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     uploaded_files = request.files.getlist("files")
     if not uploaded_files:
         return jsonify({"error": "No files uploaded"}), 400
 
-    file_texts = {}
-    for f in uploaded_files:
-        file_content = f.read()
-        parsed_text = extract_text_from_file(file_content, f.filename)
-        if parsed_text.strip():
-            file_texts[f.filename] = parsed_text
-
-    if not file_texts:
-        return jsonify({"error": "No valid text in any file"}), 400
-
-    response = handle_new_documentation("", display_name, description, file_texts)
-    if response["status"] == "OK":
-        save_corpus_registry()
-        return jsonify({
-            "message": "File(s) indexed successfully in Vertex RAG",
-            "corpus_name": response["corpus_name"]
-        }), 200
-    else:
-        return jsonify({"error": "Could not index the uploaded files."}), 400
+    # Large files stay in their spool files; the job deletes them when it ends
+    files = request.claim_uploads("files")
+
+    def run(job):
+        file_texts, extraction_errors = extract_uploaded_files(files, job)
+
+        if not file_texts:
+            return {"error": "No valid text in any file", "extraction_errors": extraction_errors}, 400
+
+        response = handle_new_documentation("", display_name, description, file_texts, chunking=chunking,
+                                            on_progress=job.increment, job_id=job.id,
+                                            check_cancelled=job.check_cancelled)
+        if response["status"] == "OK":
+            save_corpus_registry()
+            return {
+                "message": "File(s) indexed successfully in Vertex RAG",
+                "corpus_name": response["corpus_name"],
+                "ingestion": response["ingestion"],
+                "extraction_errors": extraction_errors
+            }, 200
+        else:
+            return {"error": "Could not index the uploaded files.",
+                    "ingestion": response.get("ingestion")}, 400
+
+    return job_accepted(jobs.submit("upload", run, {"display_name": display_name, "files": len(files)},
+                                    cleanup=lambda: remove_uploads(files)))
 
 
 ############################################
@@ -343,6 +558,10 @@ def add_data_to_existing_corpus(corpus_name):
     uploaded_files = request.files.getlist("files")
     if not uploaded_files:
         return jsonify({"error": "No files uploaded"}), 400
+    try:
+        chunking = chunking_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # Check that the corpus actually exists
     try:
@@ -352,45 +571,62 @@ def add_data_to_existing_corpus(corpus_name):
     except Exception as e:
         return jsonify({"error": f"Error retrieving corpus: {e}"}), 404
 
-    file_texts = {}
-    for f in uploaded_files:
-        file_content = f.read()
-        parsed_text = extract_text_from_file(file_content, f.filename)
-        if parsed_text.strip():
-            file_texts[f.filename] = parsed_text
+    files = request.claim_uploads("files")
 
-    if not file_texts:
-        return jsonify({"error": "No valid text extracted from any file."}), 400
+    def run(job):
+        file_texts, extraction_errors = extract_uploaded_files(files, job)
 
-    import tempfile, os
-    from utils import upload_to_gcs
+        if not file_texts:
+            return {"error": "No valid text extracted from any file.", "extraction_errors": extraction_errors}, 400
 
-    paths = []
-    gcs_paths = []
-    try:
-        for filename, text in file_texts.items():
-            with tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False, encoding="utf-8") as tmp_file:
-                tmp_file.write(text)
-                tmp_file_path = tmp_file.name
-                paths.append(tmp_file_path)
+        result = ingest_documents(corpus_name, file_texts, chunking=chunking, on_progress=job.increment,
+                                  job_id=job.id, check_cancelled=job.check_cancelled)
+        if not result["imported"] and not result["unchanged"]:
+            return {"error": "None of the files could be imported.",
+                    "ingestion": ingestion_summary(result)}, 400
 
-            gcs_path = f"gs://{GCS_BUCKET_NAME}/{os.path.basename(tmp_file_path)}"
-            upload_to_gcs(GCS_BUCKET_NAME, os.path.basename(tmp_file_path), text, content_type="text/plain")
-            gcs_paths.append(gcs_path)
+        return {
+            "message": f"Successfully added {result['imported']} file(s) to {corpus_name}",
+            "ingestion": ingestion_summary(result),
+            "extraction_errors": extraction_errors
+        }, 200
 
-        if not gcs_paths:
-            return jsonify({"error": "No valid documents to import"}), 400
+    return job_accepted(jobs.submit("add_data", run, {"corpus_name": corpus_name, "files": len(files)},
+                                    cleanup=lambda: remove_uploads(files)))
 
-        batch_size = 25
-        for i in range(0, len(gcs_paths), batch_size):
-            batch = gcs_paths[i : i + batch_size]
-            import_files_to_corpus(corpus_name=corpus_name, paths=batch)
-    finally:
-        for path in paths:
-            os.remove(path)
-        cleanup_gcs_bucket_parallel(GCS_BUCKET_NAME)
 
-    return jsonify({"message": f"Successfully added {len(gcs_paths)} file(s) to {corpus_name}"}), 200
+#################################
+# Background jobs
+#################################
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Status, progress counters and, once finished, the result of an ingestion job."""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    """Stops a job at its next page or file; work already imported stays in the corpus."""
+    job = jobs.cancel(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 202
+
+
+#################################
+# Caches
+#################################
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Hit rates, sizes and time saved by the chat caches."""
+    return jsonify({"answers": answer_cache.stats(), "retrieval": retrieval_cache.stats()}), 200
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": f"Request exceeds the {MAX_CONTENT_LENGTH // (1024 * 1024)} MB upload limit"}), 413
 
 
 @app.route("/health", methods=["GET"])
@@ -398,5 +634,13 @@ def health():
     return "OK", 200
 
 
-if __name__ == "__main__":
+def run():
+    """Starts the backend; server.py calls this in the container."""
+    # Remove files staged by jobs a previous process did not finish, without delaying startup
+    threading.Thread(target=cleanup_stale_staging, args=(jobs.is_active,), name="staging-cleanup",
+                     daemon=True).start()
     app.run(debug=False, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
+
+
+if __name__ == "__main__":
+    run()
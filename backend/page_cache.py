@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse
+from typing import Dict, List, Optional
+
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR", ".page_cache")
+
+
+def content_hash(content: bytes) -> str:
+    """Returns the hex digest used to detect unchanged page bodies."""
+    return hashlib.sha256(content).hexdigest()
+
+
+class PageCache:
+    """
+    Persistent HTTP validator cache for the scraper. Each URL keeps its
+    ETag, Last-Modified, body hash, and the text and links parsed from it,
+    so an unchanged page can be answered without downloading or parsing it
+    again. Entries are stored as one JSON file per host under `cache_dir`.
+    """
+
+    def __init__(self, cache_dir: str = PAGE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Dict[str, dict]] = {}
+        self._dirty = set()
+
+    def _host_file(self, host: str) -> str:
+        safe_host = "".join(c if c.isalnum() or c in "-." else "_" for c in host)
+        return os.path.join(self.cache_dir, f"{safe_host}.json")
+
+    def _entries(self, url: str) -> Dict[str, dict]:
+        """Returns the (lazily loaded) entries for the URL's host. Caller holds the lock."""
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            entries = {}
+            path = self._host_file(host)
+            if os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        entries = json.load(f)
+                except Exception as e:
+                    logging.error(f"Could not load page cache {path}: {e}")
+            self._hosts[host] = entries
+        return self._hosts[host]
+
+    def get(self, url: str) -> Optional[dict]:
+        with self._lock:
+            return self._entries(url).get(url)
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """Builds If-None-Match / If-Modified-Since headers for a cached URL."""
+        entry = self.get(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str],
+            body_hash: str, text: str, links: List[str]) -> None:
+        with self._lock:
+            self._entries(url)[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "content_hash": body_hash,
+                "text": text,
+                "links": links,
+                "fetched_at": time.time(),
+            }
+            self._dirty.add(urlparse(url).netloc)
+
+    def touch(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """Marks a cached URL as revalidated, refreshing any new validators."""
+        with self._lock:
+            entry = self._entries(url).get(url)
+            if not entry:
+                return
+            if etag:
+                entry["etag"] = etag
+            if last_modified:
+                entry["last_modified"] = last_modified
+            entry["fetched_at"] = time.time()
+            self._dirty.add(urlparse(url).netloc)
+
+    def save(self) -> None:
+        """Writes every host file that changed since the last save."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            snapshots = {host: dict(self._hosts[host]) for host in dirty}
+        if not snapshots:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for host, entries in snapshots.items():
+            path = self._host_file(host)
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logging.error(f"Could not save page cache {path}: {e}")
@@ -0,0 +1,97 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Bytes of retrieved text kept across all corpora; 0 turns the cache off
+RETRIEVAL_CACHE_MAX_BYTES = int(os.environ.get("RETRIEVAL_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+# Rough per-context overhead on top of its text
+CONTEXT_OVERHEAD_BYTES = 200
+
+
+def _size(contexts: List[Any]) -> int:
+    return sum(len(getattr(context, "text", "") or "") + len(getattr(context, "source_uri", "") or "")
+               + CONTEXT_OVERHEAD_BYTES for context in contexts)
+
+
+class RetrievalCache:
+    """
+    LRU cache of retrieval results keyed by corpus, query text and top_k,
+    limited to `max_bytes` of retrieved text.
+
+    Every corpus has a generation counter; bump() advances it whenever the
+    corpus' content changes. Entries remember the generation they were
+    retrieved at and are never served once it moved on. Callers read the
+    generation before querying and pass it to put(), so a result fetched
+    while an import was running is not stored as current.
+    """
+
+    def __init__(self, max_bytes: int = RETRIEVAL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str, int], Tuple[int, List[Any], int]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def generation(self, corpus_name: str) -> int:
+        with self._lock:
+            return self._generations.get(corpus_name, 0)
+
+    def bump(self, corpus_name: str) -> int:
+        """Advances the corpus' generation and drops its entries; returns the new generation."""
+        with self._lock:
+            generation = self._generations.get(corpus_name, 0) + 1
+            self._generations[corpus_name] = generation
+            stale = [key for key in self._entries if key[0] == corpus_name]
+            for key in stale:
+                self._remove(key)
+            self._stats["stale"] += len(stale)
+        logging.debug(f"Corpus {corpus_name} is at generation {generation}")
+        return generation
+
+    def _remove(self, key) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, corpus_name: str, query: str, top_k: int) -> Optional[List[Any]]:
+        if self.max_bytes <= 0:
+            return None
+        key = (corpus_name, query, top_k)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == self._generations.get(corpus_name, 0):
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return list(entry[1])
+            if entry:
+                self._remove(key)
+                self._stats["stale"] += 1
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, corpus_name: str, query: str, top_k: int, contexts: List[Any], generation: int) -> None:
+        """Stores contexts retrieved at `generation`, unless the corpus changed since."""
+        size = _size(contexts) + len(query)
+        if self.max_bytes <= 0 or size > self.max_bytes:
+            return
+        key = (corpus_name, query, top_k)
+        with self._lock:
+            if generation != self._generations.get(corpus_name, 0):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (generation, list(contexts), size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes})
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
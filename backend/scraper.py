@@ -1,79 +1,885 @@
+import io
+import os
+import gzip
+import json
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urldefrag, urlparse, urlunparse, parse_qsl, urlencode
 import logging
-from typing import List, Dict, Set, Optional
+import random
+import threading
+import time
+from collections import deque
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from xml.etree import ElementTree
+from typing import Callable, List, Dict, Set, Optional, Tuple, NamedTuple, Iterable, Iterator
+
+from page_cache import PageCache, content_hash
+from dedup import exact_hash
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# Number of pages fetched in parallel, and the cap for any single host.
+# Each host starts at half its cap and the scheduler adapts from there.
+SCRAPER_CONCURRENCY = int(os.environ.get("SCRAPER_CONCURRENCY", 8))
+SCRAPER_PER_HOST_LIMIT = int(os.environ.get("SCRAPER_PER_HOST_LIMIT", 4))
+
+# Per-request timeout in seconds, and retries for timeouts, connection
+# errors and retryable statuses, with exponential backoff and full jitter.
+SCRAPER_TIMEOUT = float(os.environ.get("SCRAPER_TIMEOUT", 20))
+SCRAPER_MAX_RETRIES = int(os.environ.get("SCRAPER_MAX_RETRIES", 3))
+SCRAPER_BACKOFF_BASE = float(os.environ.get("SCRAPER_BACKOFF_BASE", 0.5))
+SCRAPER_BACKOFF_CAP = float(os.environ.get("SCRAPER_BACKOFF_CAP", 30))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses that mean a page is gone rather than temporarily unavailable
+GONE_STATUSES = {404, 410}
+# Statuses that mean the host is overloaded and concurrency must drop
+THROTTLE_STATUSES = {429, 503}
+MAX_RETRY_AFTER = 120
+
+# Query parameters dropped during canonicalization; shell-style patterns are allowed.
+SCRAPER_STRIP_QUERY_PARAMS = [
+    p.strip() for p in os.environ.get("SCRAPER_STRIP_QUERY_PARAMS", "utm_*,fbclid,gclid,ref").split(",") if p.strip()
+]
+
+# How scrape_documentation finds pages: by following <a> links, from the
+# site's sitemaps, or seeding from sitemaps and still following links.
+DISCOVERY_MODES = ("links", "sitemap", "both")
+MAX_SITEMAP_DEPTH = 3
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+
+# HTML parsing backend: "lxml", "stream" (stdlib tokenizer), "bs4", or
+# "auto" to use lxml when it is installed and BeautifulSoup otherwise.
+HTML_PARSER_BACKEND = os.environ.get("HTML_PARSER_BACKEND", "auto")
+
+# Crawl checkpoints are written every CRAWL_CHECKPOINT_INTERVAL pages.
+CRAWL_CHECKPOINT_INTERVAL = int(os.environ.get("CRAWL_CHECKPOINT_INTERVAL", 50))
+CRAWL_CHECKPOINT_DIR = os.environ.get("CRAWL_CHECKPOINT_DIR", ".crawl_checkpoints")
+
+HEADING_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+# Block elements whose start or end implicitly closes an open <p>.
+P_CLOSING_TAGS = {
+    "address", "article", "aside", "blockquote", "body", "dd", "details", "div", "dl", "dt",
+    "fieldset", "figcaption", "figure", "footer", "form", "header", "hr", "html", "li", "main",
+    "nav", "ol", "p", "pre", "section", "table", "td", "th", "ul", *HEADING_TAGS,
+}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+INDEX_PAGES = ("index.html", "index.htm")
+
 
 def is_relative_url(url: str) -> bool:
     """Checks if a URL is relative"""
     parsed_url = urlparse(url)
     return not parsed_url.scheme
 
+def _canonical_netloc(parsed) -> str:
+    """Lower-cased host with the scheme's default port removed."""
+    host = (parsed.hostname or "").lower()
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(parsed.scheme.lower()):
+        host = f"{host}:{port}"
+    return host
+
 def is_same_domain(base_url: str, url: str) -> bool:
     """Check if both URLs have the same domain."""
-    base_domain = urlparse(base_url).netloc
-    url_domain = urlparse(url).netloc
+    base_domain = _canonical_netloc(urlparse(base_url))
+    url_domain = _canonical_netloc(urlparse(url))
     return base_domain == url_domain
 
-def get_links_from_page(base_url: str, page_url: str) -> List[str]:
-    """Gets all valid links from a page."""
+def canonicalize_url(url: str, strip_query_params: Optional[List[str]] = None) -> str:
+    """
+    Normalizes a URL so that variants of the same page compare equal:
+    drops the fragment, default ports, trailing slashes, index pages and
+    the query parameters matching `strip_query_params`, and sorts the rest.
+    """
+    if strip_query_params is None:
+        strip_query_params = SCRAPER_STRIP_QUERY_PARAMS
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+
+    path = parsed.path or "/"
+    segments = path.split("/")
+    if segments[-1].lower() in INDEX_PAGES:
+        segments[-1] = ""
+        path = "/".join(segments)
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+
+    query = [
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not any(fnmatch(key, pattern) for pattern in strip_query_params)
+    ]
+    query.sort()
+    return urlunparse((scheme, _canonical_netloc(parsed), path, parsed.params, urlencode(query), ""))
+
+def _url_key(canonical_url: str) -> str:
+    """Dedup key for a canonical URL; http and https variants share a key."""
+    return canonical_url.split("://", 1)[-1]
+
+class PageResult(NamedTuple):
+    """
+    Outcome of fetching one page; `unchanged` is set when the cached copy
+    was still valid, `failed` when the page could not be fetched for any
+    reason other than being gone (404 / 410).
+    """
+    text: str
+    links: List[str]
+    unchanged: bool = False
+    failed: bool = False
+
+def create_session(pool_size: int = SCRAPER_CONCURRENCY) -> requests.Session:
+    """Creates a session whose keep-alive connection pool fits `pool_size` parallel fetches."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _resolve_links(base_url: str, page_url: str, hrefs: List[str]) -> List[str]:
+    """Turns raw hrefs into absolute same-domain links."""
+    full_links = []
+    for link in hrefs:
+        if is_relative_url(link):
+            full_link = urljoin(page_url, link)
+        else:
+            full_link = link
+        if is_same_domain(base_url, full_link):
+            full_links.append(full_link)
+    return list(set(full_links))
+
+def _render_blocks(blocks: Iterable[Tuple[str, str]]) -> str:
+    """
+    Joins (tag, text) blocks in document order into page text: one block per
+    paragraph separated by blank lines, headings as Markdown headings, so
+    later stages can split pages on their structure.
+    """
+    rendered = []
+    for tag, text in blocks:
+        text = " ".join(text.split())
+        if not text:
+            continue
+        if tag in HEADING_TAGS:
+            text = f"{'#' * int(tag[1])} {text}"
+        rendered.append(text)
+    return "\n\n".join(rendered)
+
+class _TextLinkCollector:
+    """
+    Parser event sink that gathers paragraph text, heading text and hrefs in
+    a single pass over the document. Works as an lxml parser target and
+    backs the stdlib streaming tokenizer.
+    """
+
+    def __init__(self):
+        self.blocks: List[Tuple[str, List[str]]] = []
+        self.hrefs: List[str] = []
+        self._open: List[Tuple[str, List[str]]] = []
+
+    def start(self, tag: str, attrib) -> None:
+        tag = tag.lower()
+        if tag == "a":
+            href = attrib.get("href")
+            if href:
+                self.hrefs.append(href)
+        if tag in P_CLOSING_TAGS:
+            self._close("p")
+        if tag == "p" or tag in HEADING_TAGS:
+            parts: List[str] = []
+            self.blocks.append((tag, parts))
+            self._open.append((tag, parts))
+
+    def _close(self, tag: str) -> bool:
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                del self._open[i:]
+                return True
+        return False
+
+    def end(self, tag: str) -> None:
+        tag = tag.lower()
+        if not self._close(tag) and tag in P_CLOSING_TAGS:
+            self._close("p")
+
+    def data(self, data: str) -> None:
+        for _, parts in self._open:
+            parts.append(data)
+
+    def close(self) -> Tuple[str, List[str]]:
+        return _render_blocks((tag, "".join(parts)) for tag, parts in self.blocks), self.hrefs
+
+
+class _StreamingHTMLParser(HTMLParser):
+    """Stdlib tokenizer feeding a _TextLinkCollector without building a tree."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.collector = _TextLinkCollector()
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def _parse_with_bs4(content: bytes) -> Tuple[str, List[str]]:
+    soup = BeautifulSoup(content, "html.parser")
+    # You might need to fine-tune this depending on the website's structure
+    text = _render_blocks((tag.name, tag.get_text()) for tag in soup.find_all(["p", *HEADING_TAGS]))
+    hrefs = [a.get("href") for a in soup.find_all("a") if a.get("href")]
+    return text.strip(), hrefs
+
+def _parse_with_stream(content: bytes) -> Tuple[str, List[str]]:
+    parser = _StreamingHTMLParser()
+    parser.feed(content.decode("utf-8", errors="replace"))
+    parser.close()
+    return parser.collector.close()
+
+def _parse_with_lxml(content: bytes) -> Tuple[str, List[str]]:
+    parser = lxml_etree.HTMLParser(target=_TextLinkCollector())
+    parser.feed(content)
+    return parser.close()
+
+HTML_PARSERS = {
+    "lxml": _parse_with_lxml,
+    "stream": _parse_with_stream,
+    "bs4": _parse_with_bs4,
+}
+
+def available_html_parsers() -> List[str]:
+    """Lists the parser backends usable in this environment."""
+    return [name for name in HTML_PARSERS if name != "lxml" or lxml_etree is not None]
+
+def parse_html(content: bytes, backend: Optional[str] = None) -> Tuple[str, List[str]]:
+    """
+    Extracts page text and raw hrefs with the selected backend, falling
+    back to BeautifulSoup when the backend is unavailable or fails.
+    """
+    backend = backend or HTML_PARSER_BACKEND
+    if backend == "auto":
+        backend = "lxml" if lxml_etree is not None else "bs4"
+    if backend not in available_html_parsers():
+        logging.warning(f"HTML parser backend {backend} is not available, using bs4.")
+        backend = "bs4"
+    if backend != "bs4":
+        try:
+            return HTML_PARSERS[backend](content)
+        except Exception as e:
+            logging.warning(f"{backend} failed to parse page, retrying with bs4: {e}")
+    return _parse_with_bs4(content)
+
+def _parse_page(base_url: str, page_url: str, content: bytes) -> Tuple[str, List[str]]:
+    """Parses a page once and returns its text and same-domain links."""
+    text, hrefs = parse_html(content)
+    return text, _resolve_links(base_url, page_url, hrefs)
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return None
     try:
-        response = requests.get(page_url)
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+class _HostState:
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.in_flight = 0
+        self.crawl_delay = 0.0
+        self.next_start = 0.0
+        self.latency = None
+        self.base_latency = None
+        self.last_decrease = 0.0
+
+
+class HostScheduler:
+    """
+    Per-host politeness and rate control. Each host gets an adaptive
+    concurrency limit managed with AIMD: every fast success adds roughly one
+    slot per round trip, while 429/503 responses, connection failures or
+    latency climbing well above the host's best observed latency halve it
+    (at most once per round trip). Crawl-delay from robots.txt and
+    Retry-After headers space out request starts on top of that.
+    """
+
+    SLOW_LATENCY_FACTOR = 3.0
+
+    def __init__(self, max_per_host: int = SCRAPER_PER_HOST_LIMIT):
+        self.max_per_host = max(1, max_per_host)
+        self._cond = threading.Condition()
+        self._hosts: Dict[str, _HostState] = {}
+
+    def _state(self, host: str) -> _HostState:
+        if host not in self._hosts:
+            self._hosts[host] = _HostState(max(1.0, self.max_per_host / 2))
+        return self._hosts[host]
+
+    def set_crawl_delay(self, url: str, delay: float) -> None:
+        """Applies a robots.txt Crawl-delay: requests to the host are serialized and spaced."""
+        with self._cond:
+            state = self._state(urlparse(url).netloc)
+            state.crawl_delay = max(0.0, delay)
+            if state.crawl_delay:
+                state.limit = 1.0
+
+    def limit(self, url: str) -> float:
+        with self._cond:
+            return self._state(urlparse(url).netloc).limit
+
+    def acquire(self, url: str) -> str:
+        """Blocks until the host has a free slot and its start delay has passed."""
+        host = urlparse(url).netloc
+        with self._cond:
+            state = self._state(host)
+            while True:
+                wait_for = state.next_start - time.monotonic()
+                if state.in_flight < int(state.limit) and wait_for <= 0:
+                    break
+                self._cond.wait(timeout=wait_for if wait_for > 0 else None)
+            state.in_flight += 1
+            state.next_start = time.monotonic() + state.crawl_delay
+        return host
+
+    def release(self, host: str, latency: Optional[float] = None, status: Optional[int] = None,
+                retry_after: Optional[float] = None) -> None:
+        """Frees a slot and adapts the host's limit; `status` is None for connection failures."""
+        with self._cond:
+            state = self._state(host)
+            state.in_flight -= 1
+            now = time.monotonic()
+            overloaded = status is None or status in THROTTLE_STATUSES
+            if latency is not None and not overloaded:
+                state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+                state.base_latency = latency if state.base_latency is None else min(state.base_latency, latency)
+                overloaded = state.latency > self.SLOW_LATENCY_FACTOR * state.base_latency
+            if overloaded:
+                if now - state.last_decrease > (state.latency or 1.0):
+                    state.limit = max(1.0, state.limit / 2)
+                    state.last_decrease = now
+                    logging.info(f"Reducing concurrency for {host} to {int(state.limit)}")
+            elif not state.crawl_delay:
+                state.limit = min(float(self.max_per_host), state.limit + 1.0 / state.limit)
+            if retry_after:
+                state.next_start = max(state.next_start, now + retry_after)
+            self._cond.notify_all()
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(SCRAPER_BACKOFF_CAP, SCRAPER_BACKOFF_BASE * (2 ** attempt)))
+
+def _get(url: str, session: Optional[requests.Session] = None, headers: Optional[Dict[str, str]] = None,
+         scheduler: Optional[HostScheduler] = None) -> requests.Response:
+    """
+    GET with a timeout and bounded, jittered retries on connection errors,
+    timeouts and retryable statuses. Each attempt holds a scheduler slot.
+    """
+    for attempt in range(SCRAPER_MAX_RETRIES + 1):
+        host = scheduler.acquire(url) if scheduler else None
+        start = time.monotonic()
+        response = None
+        retry_after = None
+        try:
+            response = (session or requests).get(url, headers=headers, timeout=SCRAPER_TIMEOUT)
+            retry_after = _retry_after_seconds(response.headers.get("Retry-After"))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == SCRAPER_MAX_RETRIES:
+                raise
+            logging.warning(f"Retrying {url} after error: {e}")
+        finally:
+            if scheduler:
+                scheduler.release(host, time.monotonic() - start,
+                                  response.status_code if response is not None else None, retry_after)
+        if response is not None:
+            if response.status_code not in RETRY_STATUSES or attempt == SCRAPER_MAX_RETRIES:
+                return response
+            logging.warning(f"Retrying {url} after HTTP {response.status_code}")
+        # With a scheduler, Retry-After is enforced through the host's next start time
+        delay = _backoff(attempt)
+        if not scheduler and retry_after:
+            delay = max(delay, retry_after)
+        time.sleep(delay)
+    raise requests.exceptions.RetryError(f"Giving up on {url}")
+
+def fetch_page(base_url: str, page_url: str, session: Optional[requests.Session] = None,
+               cache: Optional[PageCache] = None, scheduler: Optional[HostScheduler] = None) -> PageResult:
+    """
+    Downloads a page once and returns its text and same-domain links.
+    With a cache, the request is conditional and a 304 or an identical body
+    is answered from the cached parse instead of parsing the page again.
+    With a scheduler, the request is rate-controlled per host.
+    """
+    cached = cache.get(page_url) if cache else None
+    headers = cache.conditional_headers(page_url) if cache else {}
+    try:
+        response = _get(page_url, session, headers, scheduler)
+        if cached and response.status_code == 304:
+            cache.touch(page_url)
+            return PageResult(cached["text"], cached["links"], True)
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
-        links = [a.get("href") for a in soup.find_all("a") if a.get("href")]
-
-        full_links = []
-        for link in links:
-           if is_relative_url(link):
-               full_link = urljoin(base_url, link)
-           else:
-              full_link = link
-           if is_same_domain(base_url, full_link):
-              full_links.append(full_link)
-        return list(set(full_links))
     except requests.exceptions.RequestException as e:
-         logging.error(f"Error fetching {page_url}: {e}")
-         return []
+        status = e.response.status_code if getattr(e, "response", None) is not None else None
+        if status in GONE_STATUSES:
+            logging.info(f"{page_url} is gone (HTTP {status})")
+            return PageResult("", [])
+        logging.error(f"Error fetching {page_url}: {e}")
+        return PageResult("", [], failed=True)
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    body_hash = content_hash(response.content) if cache else ""
+    if cached and cached.get("content_hash") == body_hash:
+        cache.touch(page_url, etag, last_modified)
+        return PageResult(cached["text"], cached["links"], True)
+
+    text, links = _parse_page(base_url, response.url, response.content)
+    if cache:
+        cache.put(page_url, etag, last_modified, body_hash, text, links)
+    return PageResult(text, links)
+
+def get_links_from_page(base_url: str, page_url: str) -> List[str]:
+    """Gets all valid links from a page."""
+    return fetch_page(base_url, page_url)[1]
 
 def extract_text_from_page(page_url: str) -> str:
     """Extracts text from a page."""
+    return fetch_page(page_url, page_url)[0]
+
+
+def fetch_robots_txt(base_url: str, session: Optional[requests.Session] = None) -> Optional[str]:
+    """Returns the site's robots.txt, or None if it has none."""
     try:
-        response = requests.get(page_url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
-        # You might need to fine-tune this depending on the website's structure
-        text = " ".join(p.get_text() for p in soup.find_all("p")) # This might need a more custom approach
-        text += " ".join(h.get_text() for h in soup.find_all(["h1", "h2", "h3", "h4", "h5", "h6"]))
-        return text.strip()
+        response = _get(urljoin(base_url, "/robots.txt"), session)
+        if response.ok:
+            return response.text
     except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching {page_url}: {e}")
-        return ""
-
-
-def scrape_documentation(base_url: str, max_pages: int, scraped_data: Optional[Dict[str,str]]=None) -> Dict[str, str]:
- """Crawls and scrapes documentation."""
- if scraped_data is None:
-     visited: Set[str] = set()
- else:
-     visited = set(scraped_data.keys())
- to_visit = [base_url]
- scraped_data = scraped_data if scraped_data else {}
- 
- while to_visit and len(visited) < max_pages:
-     url = to_visit.pop(0)
-     if url in visited:
-         continue
-     logging.info(f"Scraping {url}")
-     
-     visited.add(url)
-     text = extract_text_from_page(url)
-     if text:
-         scraped_data[url] = text
-     
-     links = get_links_from_page(base_url, url)
-     for link in links:
-         if link not in visited:
-            to_visit.append(link)
- logging.info(f"Scraped {len(visited)} pages.")
- return scraped_data
\ No newline at end of file
+        logging.warning(f"Could not read robots.txt for {base_url}: {e}")
+    return None
+
+def robots_crawl_delay(robots_txt: Optional[str]) -> float:
+    """
+    Crawl-delay that robots.txt sets for the "*" user agent, in seconds.
+    Parsed by hand because urllib.robotparser drops fractional delays.
+    """
+    agents: List[str] = []
+    in_rules = False
+    for line in (robots_txt or "").splitlines():
+        key, _, value = line.split("#", 1)[0].partition(":")
+        key, value = key.strip().lower(), value.strip()
+        if key == "user-agent":
+            if in_rules:
+                agents, in_rules = [], False
+            agents.append(value)
+        elif key:
+            in_rules = True
+            if key == "crawl-delay" and "*" in agents:
+                try:
+                    return max(0.0, float(value))
+                except ValueError:
+                    return 0.0
+    return 0.0
+
+def find_sitemaps(base_url: str, session: Optional[requests.Session] = None,
+                  robots_txt: Optional[str] = None) -> List[str]:
+    """Lists the sitemaps advertised in robots.txt, falling back to /sitemap.xml."""
+    if robots_txt is None:
+        robots_txt = fetch_robots_txt(base_url, session)
+    sitemaps = []
+    for line in (robots_txt or "").splitlines():
+        key, _, value = line.partition(":")
+        if key.strip().lower() == "sitemap" and value.strip():
+            sitemaps.append(value.strip())
+    return sitemaps or [urljoin(base_url, "/sitemap.xml")]
+
+def _parse_lastmod(value: Optional[str]) -> Optional[float]:
+    """Parses a W3C datetime <lastmod> into a UTC timestamp."""
+    if not value:
+        return None
+    value = value.strip().replace("Z", "+00:00")
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = datetime.strptime(value[:10], "%Y-%m-%d")
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def _read_sitemap(sitemap_url: str, session: Optional[requests.Session] = None) -> Optional[ElementTree.Element]:
+    """Downloads a sitemap, gunzipping it if needed, and returns its root element."""
+    try:
+        response = _get(sitemap_url, session)
+        response.raise_for_status()
+        content = response.content
+        if content[:2] == b"\x1f\x8b":
+            with gzip.GzipFile(fileobj=io.BytesIO(content)) as gz:
+                content = gz.read(MAX_SITEMAP_BYTES)
+        return ElementTree.fromstring(content)
+    except (requests.exceptions.RequestException, OSError, ElementTree.ParseError) as e:
+        logging.warning(f"Could not read sitemap {sitemap_url}: {e}")
+        return None
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+def discover_sitemap_urls(base_url: str, session: Optional[requests.Session] = None,
+                          robots_txt: Optional[str] = None) -> List[Tuple[str, Optional[float]]]:
+    """
+    Lists every same-domain page URL in the site's sitemaps together with its
+    <lastmod> timestamp, following sitemap index files up to MAX_SITEMAP_DEPTH.
+    """
+    pages = []
+    seen_sitemaps: Set[str] = set()
+    pending = [(url, 0) for url in find_sitemaps(base_url, session, robots_txt)]
+    while pending:
+        sitemap_url, depth = pending.pop(0)
+        if sitemap_url in seen_sitemaps or depth > MAX_SITEMAP_DEPTH:
+            continue
+        seen_sitemaps.add(sitemap_url)
+        root = _read_sitemap(sitemap_url, session)
+        if root is None:
+            continue
+        is_index = _local_name(root.tag) == "sitemapindex"
+        for entry in root:
+            fields = {_local_name(child.tag): (child.text or "").strip() for child in entry}
+            loc = fields.get("loc")
+            if not loc:
+                continue
+            if is_index:
+                pending.append((loc, depth + 1))
+            elif is_same_domain(base_url, loc):
+                pages.append((loc, _parse_lastmod(fields.get("lastmod"))))
+    logging.info(f"Discovered {len(pages)} pages from {len(seen_sitemaps)} sitemap(s) of {base_url}")
+    return pages
+
+
+class CrawlFrontier:
+    """
+    FIFO crawl frontier with O(1) enqueue/dequeue. The canonical form of
+    every URL is remembered once it has been queued, so each page enters the
+    queue at most once no matter how many links point to it. The queue keeps
+    the URL as it was found (minus the fragment): servers that answer both
+    /guide and /guide/ without a redirect resolve relative links
+    differently, so the page is fetched the way it was linked.
+    """
+
+    def __init__(self, strip_query_params: Optional[List[str]] = None):
+        self.strip_query_params = strip_query_params
+        self._queue: deque = deque()
+        self._seen: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def canonicalize(self, url: str) -> str:
+        return canonicalize_url(url, self.strip_query_params)
+
+    def mark_seen(self, url: str) -> None:
+        """Records a URL as already handled without queueing it."""
+        self._seen.add(_url_key(self.canonicalize(url)))
+
+    def is_seen(self, url: str) -> bool:
+        return _url_key(self.canonicalize(url)) in self._seen
+
+    def add(self, url: str) -> bool:
+        """Queues a URL unless it (or a variant of it) was seen before."""
+        key = _url_key(self.canonicalize(url))
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        self._queue.append(urldefrag(url.strip())[0])
+        return True
+
+    def pop(self) -> str:
+        return self._queue.popleft()
+
+    def queued(self) -> List[str]:
+        return list(self._queue)
+
+    def seen_keys(self) -> List[str]:
+        return list(self._seen)
+
+    def restore(self, queued: Iterable[str], seen_keys: Iterable[str]) -> None:
+        """Reloads a frontier saved with queued() / seen_keys()."""
+        self._seen.update(seen_keys)
+        for url in queued:
+            self._seen.add(_url_key(self.canonicalize(url)))
+            self._queue.append(url)
+
+
+class LocalCheckpointStore:
+    """Keeps crawl checkpoints as JSON files in a local directory."""
+
+    def __init__(self, directory: str = CRAWL_CHECKPOINT_DIR):
+        self.directory = directory
+
+    def _path(self, crawl_id: str) -> str:
+        return os.path.join(self.directory, f"{crawl_id}.json")
+
+    def load(self, crawl_id: str) -> Optional[dict]:
+        path = self._path(crawl_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"Could not load crawl checkpoint {path}: {e}")
+            return None
+
+    def save(self, crawl_id: str, state: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(crawl_id)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+    def delete(self, crawl_id: str) -> None:
+        path = self._path(crawl_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class CrawlCheckpoint:
+    """
+    Resumable crawl state: the frontier (queued URLs and seen set), the
+    number of pages visited, and the content hash of every scraped page.
+    Scraped pages stay "pending" until the consumer confirms them with
+    mark_done() (e.g. once they are imported), so a resumed crawl fetches
+    unconfirmed pages again instead of losing them. `store` is any object
+    with load/save/delete(crawl_id), such as LocalCheckpointStore.
+    """
+
+    def __init__(self, store, crawl_id: str, resume: bool = False,
+                 interval: int = CRAWL_CHECKPOINT_INTERVAL):
+        self.store = store
+        self.crawl_id = crawl_id
+        self.interval = max(1, interval)
+        self._lock = threading.Lock()
+        self.state = store.load(crawl_id) if resume else None
+        self._pending: Dict[str, str] = dict(self.state["pending"]) if self.state else {}
+        self._done: Dict[str, str] = dict(self.state["done"]) if self.state else {}
+        self._since_save = 0
+        if resume and not self.state:
+            logging.info(f"No checkpoint found for crawl {crawl_id}, starting from scratch.")
+
+    @property
+    def resumed(self) -> bool:
+        return self.state is not None
+
+    def page_hashes(self) -> Dict[str, str]:
+        """Content hashes of the pages confirmed before the last restart."""
+        with self._lock:
+            return dict(self._done)
+
+    def requeue_urls(self) -> List[str]:
+        """URLs that were scraped or in flight but never confirmed."""
+        if not self.state:
+            return []
+        return list(self._pending) + list(self.state.get("in_flight", []))
+
+    def record_page(self, url: str, text: str) -> None:
+        with self._lock:
+            self._pending[url] = exact_hash(text)
+
+    def mark_done(self, urls: Iterable[str]) -> None:
+        with self._lock:
+            for url in urls:
+                if url in self._pending:
+                    self._done[url] = self._pending.pop(url)
+
+    def save(self, frontier: CrawlFrontier, in_flight: Iterable[str], visited_count: int,
+             follow_links: bool) -> None:
+        with self._lock:
+            state = {
+                "frontier": frontier.queued(),
+                "seen": frontier.seen_keys(),
+                "in_flight": list(in_flight),
+                "pending": dict(self._pending),
+                "done": dict(self._done),
+                "visited_count": visited_count,
+                "follow_links": follow_links,
+                "saved_at": time.time(),
+            }
+            self._since_save = 0
+        try:
+            self.store.save(self.crawl_id, state)
+        except Exception as e:
+            logging.error(f"Could not save crawl checkpoint {self.crawl_id}: {e}")
+
+    def maybe_save(self, *args) -> None:
+        """Saves once every `interval` calls."""
+        self._since_save += 1
+        if self._since_save >= self.interval:
+            self.save(*args)
+
+    def clear(self) -> None:
+        """Drops the checkpoint once the crawl's pages are fully ingested."""
+        try:
+            self.store.delete(self.crawl_id)
+        except Exception as e:
+            logging.error(f"Could not delete crawl checkpoint {self.crawl_id}: {e}")
+
+
+def iter_documentation(base_url: str, max_pages: int, seen_urls: Iterable[str] = (),
+                       concurrency: int = SCRAPER_CONCURRENCY,
+                       per_host_limit: int = SCRAPER_PER_HOST_LIMIT,
+                       strip_query_params: Optional[List[str]] = None,
+                       cache: Optional[PageCache] = None,
+                       discovery: str = "links",
+                       checkpoint: Optional[CrawlCheckpoint] = None,
+                       on_failed: Optional[Callable[[str], None]] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Crawls documentation and yields (url, text) pairs as soon as each page is
+    scraped, fetching up to `concurrency` pages at a time. Requests to each
+    host are paced by a HostScheduler capped at `per_host_limit` that honors
+    the site's robots.txt Crawl-delay. Pages in
+    `seen_urls` are skipped but count towards `max_pages`. New fetches are
+    only dispatched while the consumer keeps pulling, so a slow consumer
+    throttles the crawl.
+
+    With a `cache`, pages are revalidated with conditional requests and
+    unchanged ones are answered from the cached parse. They are still
+    yielded: whether a page needs indexing depends on the corpus it goes
+    to, which the consumer decides (see utils.CorpusManifest).
+
+    `discovery` selects how pages are found (see DISCOVERY_MODES). In the
+    sitemap modes the frontier is seeded from robots.txt / sitemap.xml, and
+    cached pages whose <lastmod> is older than their last fetch are reused
+    without a request.
+
+    With a `checkpoint`, the crawl state is saved periodically and when the
+    generator stops; a checkpoint loaded with resume=True continues from
+    the saved frontier instead of starting at `base_url`.
+
+    Pages that could not be fetched (errors other than 404 / 410) are not
+    yielded but passed to `on_failed`, so a caller mirroring the site can
+    tell them apart from pages that are gone.
+    """
+    if discovery not in DISCOVERY_MODES:
+        raise ValueError(f"Unknown discovery mode: {discovery}")
+    frontier = CrawlFrontier(strip_query_params)
+    visited_count = 0
+    for url in seen_urls:
+        frontier.mark_seen(url)
+        visited_count += 1
+    concurrency = max(1, concurrency)
+    follow_links = discovery != "sitemap"
+    resumed = checkpoint is not None and checkpoint.resumed
+    if resumed:
+        requeue = checkpoint.requeue_urls()
+        frontier.restore(requeue + checkpoint.state["frontier"], checkpoint.state["seen"])
+        visited_count += max(0, checkpoint.state["visited_count"] - len(requeue))
+        follow_links = checkpoint.state.get("follow_links", follow_links)
+        logging.info(f"Resuming crawl of {base_url} with {len(frontier)} queued pages.")
+    in_flight = {}
+
+    session = create_session(concurrency)
+    scheduler = HostScheduler(per_host_limit)
+
+    def crawl(url: str) -> PageResult:
+        return fetch_page(base_url, url, session, cache, scheduler)
+
+    try:
+        robots_txt = fetch_robots_txt(base_url, session)
+        crawl_delay = robots_crawl_delay(robots_txt)
+        if crawl_delay:
+            logging.info(f"Honoring Crawl-delay of {crawl_delay}s for {base_url}")
+            scheduler.set_crawl_delay(base_url, crawl_delay)
+
+        if discovery != "links" and not resumed:
+            sitemap_pages = discover_sitemap_urls(base_url, session, robots_txt)
+            if not sitemap_pages:
+                logging.warning(f"No sitemap entries found for {base_url}, falling back to link discovery.")
+                follow_links = True
+            for url, lastmod in sitemap_pages:
+                if visited_count >= max_pages:
+                    break
+                if frontier.is_seen(url):
+                    continue
+                canonical = frontier.canonicalize(url)
+                cached = cache.get(url) if cache else None
+                if cached and lastmod is not None and lastmod <= cached.get("fetched_at", 0):
+                    frontier.mark_seen(canonical)
+                    visited_count += 1
+                    # Pages only linked from unchanged ones must still be found
+                    if follow_links:
+                        for link in cached.get("links", []):
+                            frontier.add(link)
+                    if cached["text"]:
+                        if checkpoint:
+                            checkpoint.record_page(canonical, cached["text"])
+                        yield canonical, cached["text"]
+                    continue
+                frontier.add(url)
+        if not resumed:
+            frontier.add(base_url)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                while frontier and len(in_flight) < concurrency and visited_count < max_pages:
+                    url = frontier.pop()
+                    logging.info(f"Scraping {url}")
+                    visited_count += 1
+                    in_flight[executor.submit(crawl, url)] = url
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = in_flight.pop(future)
+                    result = future.result()
+                    if result.failed and on_failed:
+                        on_failed(url)
+                    if follow_links:
+                        for link in result.links:
+                            frontier.add(link)
+                    if result.text:
+                        # Pages are fetched as linked but known by their canonical URL
+                        source = frontier.canonicalize(url)
+                        if checkpoint:
+                            checkpoint.record_page(source, result.text)
+                        yield source, result.text
+                if checkpoint:
+                    checkpoint.maybe_save(frontier, in_flight.values(), visited_count, follow_links)
+    finally:
+        if checkpoint:
+            checkpoint.save(frontier, in_flight.values(), visited_count, follow_links)
+        session.close()
+        if cache:
+            cache.save()
+    logging.info(f"Scraped {visited_count} pages.")
+
+
+def scrape_documentation(base_url: str, max_pages: int, scraped_data: Optional[Dict[str,str]]=None,
+                         **crawl_options) -> Dict[str, str]:
+    """
+    Crawls and scrapes documentation into a {url: text} dict. Accepts the
+    same options as iter_documentation.
+    """
+    scraped_data = scraped_data if scraped_data else {}
+    for url, text in iter_documentation(base_url, max_pages, seen_urls=list(scraped_data), **crawl_options):
+        scraped_data[url] = text
+    return scraped_data
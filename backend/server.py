@@ -0,0 +1,11 @@
+"""
+Entry point of the backend container. Extraction workers started by the
+forkserver re-import the __main__ script (see extractors.py); with this
+file as __main__ they import nothing, instead of loading the whole app
+from main.py once per worker.
+"""
+
+if __name__ == "__main__":
+    import main
+
+    main.run()
@@ -0,0 +1,177 @@
+import os
+import gzip
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+from dedup import exact_hash
+from utils import get_storage_client, delete_gcs_objects, GCS_BUCKET_NAME
+
+# Scraped pages are kept as gzip-compressed JSONL shards under SNAPSHOT_PREFIX,
+# with an index mapping every URL to the shard holding its latest text.
+SNAPSHOT_PREFIX = os.environ.get("SNAPSHOT_PREFIX", "scraped_data/")
+SNAPSHOT_SHARD_DOCS = int(os.environ.get("SNAPSHOT_SHARD_DOCS", 500))
+# Decompressed shards kept in memory for get()
+SNAPSHOT_CACHED_SHARDS = 4
+
+
+class ScrapedDataSnapshot:
+    """
+    Sharded snapshot of scraped pages. Nothing is read until the snapshot
+    is first used: the index is loaded on demand, get() fetches only the
+    shard holding a URL, and iter_documents() streams shard by shard.
+    Writers append new shards and then update the index, deleting shards
+    whose pages have all been superseded. Without a bucket the snapshot
+    stays empty and writes are dropped.
+    """
+
+    def __init__(self, bucket_name=GCS_BUCKET_NAME, prefix=SNAPSHOT_PREFIX):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self._index = None
+        self._shards = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def _bucket(self):
+        return get_storage_client().bucket(self.bucket_name)
+
+    def _load_index(self):
+        """Returns the index, loading it on first use. Caller holds the lock."""
+        if self._index is None and self.bucket_name:
+            blob = self._bucket.blob(f"{self.prefix}index.json.gz")
+            try:
+                self._index = json.loads(gzip.decompress(blob.download_as_bytes())) if blob.exists() else None
+            except Exception as e:
+                logging.error(f"Could not load the scraped data index: {e}")
+            if self._index is None:
+                self._index = {"urls": {}, "shards": {}}
+        return self._index
+
+    def _read_shard(self, shard):
+        with self._lock:
+            if shard in self._shards:
+                self._shards.move_to_end(shard)
+                return self._shards[shard]
+        content = gzip.decompress(self._bucket.blob(f"{self.prefix}{shard}").download_as_bytes())
+        documents = {}
+        for line in content.decode("utf-8").splitlines():
+            record = json.loads(line)
+            documents[record["url"]] = record["text"]
+        with self._lock:
+            self._shards[shard] = documents
+            while len(self._shards) > SNAPSHOT_CACHED_SHARDS:
+                self._shards.popitem(last=False)
+        return documents
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load_index()["urls"])
+
+    def __contains__(self, url):
+        with self._lock:
+            return url in self._load_index()["urls"]
+
+    def get(self, url, default=None):
+        with self._lock:
+            entry = self._load_index()["urls"].get(url)
+        if not entry:
+            return default
+        return self._read_shard(entry[0]).get(url, default)
+
+    def iter_documents(self):
+        """Streams (url, text) for every page in the snapshot, one shard in memory at a time."""
+        with self._lock:
+            urls = dict(self._load_index()["urls"])
+        by_shard = {}
+        for url, (shard, _) in urls.items():
+            by_shard.setdefault(shard, []).append(url)
+        for shard, shard_urls in by_shard.items():
+            documents = self._read_shard(shard)
+            for url in shard_urls:
+                if url in documents:
+                    yield url, documents[url]
+
+    def writer(self):
+        return SnapshotWriter(self)
+
+    def _commit(self, written):
+        """Points the index at newly written shards and drops shards nothing refers to anymore."""
+        with self._lock:
+            index = self._load_index()
+            for shard, documents in written:
+                index["shards"][shard] = len(documents)
+                for url, digest in documents:
+                    index["urls"][url] = [shard, digest]
+            live = {shard for shard, _ in index["urls"].values()}
+            dead = [shard for shard in index["shards"] if shard not in live]
+            for shard in dead:
+                del index["shards"][shard]
+                self._shards.pop(shard, None)
+            content = gzip.compress(json.dumps(index).encode("utf-8"))
+        self._bucket.blob(f"{self.prefix}index.json.gz").upload_from_string(content, content_type="application/gzip")
+        if dead:
+            delete_gcs_objects(self.bucket_name, [f"{self.prefix}{shard}" for shard in dead])
+
+    def digest(self, url):
+        with self._lock:
+            entry = self._load_index()["urls"].get(url)
+        return entry[1] if entry else None
+
+
+class SnapshotWriter:
+    """
+    Adds pages to a snapshot as they are scraped. Pages whose text is
+    already in the snapshot are skipped; the rest are buffered and written
+    as a new shard every SNAPSHOT_SHARD_DOCS pages. close() writes the last
+    shard and commits everything to the index. The snapshot is a side copy
+    of the crawl, so write errors are logged and never fail the ingestion;
+    pages of a lost shard differ from the snapshot and are written again
+    by the next crawl.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.run_id = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        self._buffer = []
+        self._written = []
+
+    def add(self, url, text):
+        if not self.snapshot.bucket_name:
+            return
+        digest = exact_hash(text)
+        if self.snapshot.digest(url) == digest:
+            return
+        self._buffer.append((url, text, digest))
+        if len(self._buffer) >= SNAPSHOT_SHARD_DOCS:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        shard = f"shard-{self.run_id}-{len(self._written):05d}.jsonl.gz"
+        lines = "".join(json.dumps({"url": url, "text": text}) + "\n" for url, text, _ in self._buffer)
+        content = gzip.compress(lines.encode("utf-8"))
+        try:
+            self.snapshot._bucket.blob(f"{self.snapshot.prefix}{shard}").upload_from_string(
+                content, content_type="application/gzip")
+        except Exception as e:
+            logging.error(f"Could not write snapshot shard {shard} with {len(self._buffer)} pages: {e}")
+            self._buffer = []
+            return
+        self._written.append((shard, [(url, digest) for url, _, digest in self._buffer]))
+        logging.info(f"Wrote snapshot shard {shard} with {len(self._buffer)} pages "
+                     f"({len(lines)} bytes, {len(content)} compressed)")
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+        if self._written:
+            try:
+                self.snapshot._commit(self._written)
+            except Exception as e:
+                logging.error(f"Could not update the scraped data index with {len(self._written)} shards: {e}")
+        self._written = []
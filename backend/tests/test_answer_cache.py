@@ -0,0 +1,44 @@
+from answer_cache import AnswerCache, normalize_query, query_vector, _cosine
+
+CORPORA = ["projects/p/locations/l/ragCorpora/docs"]
+
+
+def conversation_prompt(history, message):
+    """Same layout as main.conversation_query."""
+    context = "".join(f"\n{role}: {content}" for role, content in history)
+    return (
+        f"Conversation so far:\n{context}\n"
+        f"New user query: {message}\n"
+        "Please respond as a helpful documentation assistant, using relevant docs if available."
+    )
+
+
+def shared_history():
+    history = []
+    for turn in range(9):
+        history.append(("User", f"Question {turn} about configuring the deployment pipeline and its settings"))
+        history.append(("Assistant", "The deployment pipeline is configured in the settings file. "
+                                     "Each stage lists its inputs, outputs, retries and the service account "
+                                     f"it runs as, and turn {turn} covers the options in more detail."))
+    return history
+
+
+def test_conversation_prompts_look_alike_whatever_the_question():
+    history = shared_history()
+    pricing = normalize_query(conversation_prompt(history, "What is the pricing for the enterprise tier?"))
+    logging_ = normalize_query(conversation_prompt(history, "How do I enable logging?"))
+
+    assert _cosine(query_vector(pricing), query_vector(logging_)) >= 0.95
+
+
+def test_conversation_lookup_only_serves_the_exact_query():
+    cache = AnswerCache(similarity=0.95)
+    history = shared_history()
+    pricing = conversation_prompt(history, "What is the pricing for the enterprise tier?")
+    logging_ = conversation_prompt(history, "How do I enable logging?")
+    cache.put(pricing, CORPORA, {"status": "OK", "response": "Enterprise pricing is per seat."}, 2.0)
+
+    # Similar matching hands out the pricing answer for the logging question
+    assert cache.get(logging_, CORPORA)["response"] == "Enterprise pricing is per seat."
+    assert cache.get(logging_, CORPORA, similar=False) is None
+    assert cache.get(pricing, CORPORA, similar=False)["cache"]["hit"] == "exact"
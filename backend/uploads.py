@@ -0,0 +1,67 @@
+import os
+import logging
+import tempfile
+from typing import List, Tuple, Union
+from flask import Request
+
+# Requests larger than this are rejected with 413 before any of the body is read
+MAX_CONTENT_LENGTH = int(os.environ.get("MAX_CONTENT_LENGTH", 512 * 1024 * 1024))
+# Upload requests above this many bytes are spooled to files in UPLOAD_SPOOL_DIR instead of memory.
+# On Cloud Run /tmp is memory too; point UPLOAD_SPOOL_DIR at a mounted volume to keep large uploads off RAM.
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", 1024 * 1024))
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or tempfile.gettempdir()
+
+# An uploaded file as handed to background jobs: its name, and either its bytes or the path it was spooled to
+Upload = Tuple[str, Union[bytes, str]]
+
+
+class SpoolingRequest(Request):
+    """
+    Flask request class that writes the file parts of large multipart
+    bodies straight to named files in UPLOAD_SPOOL_DIR. A handler claims
+    them with claim_uploads() to keep them past the request (the job that
+    processes them deletes them with remove_uploads()); unclaimed spool
+    files are deleted when the request closes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._spooled: List[str] = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_THRESHOLD:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+        stream = tempfile.NamedTemporaryFile("wb+", dir=UPLOAD_SPOOL_DIR, prefix="upload-", delete=False)
+        self._spooled.append(stream.name)
+        return stream
+
+    def claim_uploads(self, field: str = "files") -> List[Upload]:
+        """The files of a form field as (filename, bytes or spool path), owned by the caller from now on."""
+        uploads = []
+        for storage in self.files.getlist(field):
+            path = getattr(storage.stream, "name", None)
+            if isinstance(path, str) and path in self._spooled:
+                storage.stream.close()
+                self._spooled.remove(path)
+                uploads.append((storage.filename, path))
+            else:
+                uploads.append((storage.filename, storage.read()))
+        return uploads
+
+    def close(self) -> None:
+        super().close()
+        remove_uploads([("", path) for path in self._spooled])
+        self._spooled = []
+
+
+def remove_uploads(uploads: List[Upload]) -> None:
+    """Deletes the spool files of claimed uploads."""
+    for _, source in uploads:
+        if isinstance(source, str):
+            try:
+                os.remove(source)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"Could not remove spooled upload {source}: {e}")
@@ -5,16 +5,29 @@ import json
 import vertexai
 from vertexai.preview import rag
 from vertexai.preview.generative_models import GenerativeModel, Tool
-import tempfile
-from concurrent.futures import ThreadPoolExecutor
+import queue
+import random
+import threading
+import time
+import hashlib
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from google.api_core import exceptions as api_exceptions
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
-import io
-import PyPDF2
-import docx2txt
-import openpyxl
 from typing import Dict, Any
 
+from dedup import NearDuplicateFilter, exact_hash
+from chunking import ShardPacker, chunking_params
+from context_packer import pack_context
+from corpus_router import CorpusRouter, ProfileBuilder
+from answer_cache import AnswerCache
+from retrieval_cache import RetrievalCache
+# Re-exported: extraction used to live in this module
+from extractors import extract_text_from_file, extract_texts  # noqa: F401
+
 load_dotenv()
 
 GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME", "NO BUCKET NAME")
@@ -23,8 +36,55 @@ LOCATION = os.environ.get("LOCATION", "us-central1")
 # Initialize Vertex AI API once per session
 vertexai.init(project=PROJECT_ID, location=LOCATION)
 
+# Crawl checkpoints kept in the bucket live under this prefix
+CHECKPOINT_PREFIX = "crawl_checkpoints/"
+# Every ingestion job stages its files under STAGING_PREFIX/<job id>/ next to a manifest
+STAGING_PREFIX = os.environ.get("STAGING_PREFIX", "staging/")
+STAGING_MANIFEST_NAME = "manifest.json"
+STAGING_MANIFEST_INTERVAL = 50
+# Staged files untouched for this many seconds belong to an interrupted job and are removed at startup
+STAGING_MAX_AGE = float(os.environ.get("STAGING_MAX_AGE", 6 * 3600))
+# Per-corpus manifests of indexed sources live under this prefix
+CORPUS_MANIFEST_PREFIX = os.environ.get("CORPUS_MANIFEST_PREFIX", "corpus_manifests/")
+# GCS accepts at most 100 calls per batch request
+GCS_DELETE_BATCH_SIZE = 100
+
+# Parallel uploads used when staging documents in the bucket
+STAGING_UPLOAD_WORKERS = int(os.environ.get("STAGING_UPLOAD_WORKERS", 16))
+
+# Capacity of each queue between ingestion pipeline stages
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 50))
+
+# Corpus imports: at most IMPORT_MAX_BATCH_SIZE files (or IMPORT_MAX_BATCH_BYTES)
+# per import call, IMPORT_CONCURRENCY calls at a time sharing the project's
+# embedding quota, and IMPORT_MAX_RETRIES retries for a call that failed
+# with a transient error. Import calls take minutes, so retries back off
+# with full jitter from IMPORT_BACKOFF_BASE seconds up to IMPORT_BACKOFF_CAP.
+IMPORT_MAX_BATCH_SIZE = int(os.environ.get("IMPORT_MAX_BATCH_SIZE", 25))
+IMPORT_MIN_BATCH_SIZE = 5
+IMPORT_MAX_BATCH_BYTES = int(os.environ.get("IMPORT_MAX_BATCH_BYTES", 4 * 1024 * 1024))
+IMPORT_CONCURRENCY = int(os.environ.get("IMPORT_CONCURRENCY", 3))
+IMPORT_MAX_RETRIES = int(os.environ.get("IMPORT_MAX_RETRIES", 3))
+IMPORT_BACKOFF_BASE = float(os.environ.get("IMPORT_BACKOFF_BASE", 30))
+IMPORT_BACKOFF_CAP = float(os.environ.get("IMPORT_BACKOFF_CAP", 300))
+EMBEDDING_REQUESTS_PER_MIN = int(os.environ.get("EMBEDDING_REQUESTS_PER_MIN", 900))
+
+# Chat retrieval queries all selected corpora at once; a corpus that has not
+# answered within RETRIEVAL_TIMEOUT seconds is left out of the context.
+RETRIEVAL_TIMEOUT = float(os.environ.get("RETRIEVAL_TIMEOUT", 10.0))
+RETRIEVAL_TOP_K = 5
+
+# Ask Gemini to pick corpora when the local router cannot decide
+ROUTER_LLM_FALLBACK = os.environ.get("ROUTER_LLM_FALLBACK", "true").lower() in ("1", "true", "yes")
+
 # Global dictionary to store corpus name and its identifier. It can also be a database if needed
 corpus_registry = {}
+# Term profiles of the corpora, used to route chat queries
+corpus_router = CorpusRouter()
+# Retrieval results per corpus, query and top_k; holds each corpus' generation counter
+retrieval_cache = RetrievalCache()
+# Chat answers by query and corpora, dropped when one of the corpora changes
+answer_cache = AnswerCache(generation=retrieval_cache.generation)
 
 def setup_logging():
     log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -34,15 +94,43 @@ def setup_logging():
     logging.basicConfig(level=numeric_level, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+_storage_client = None
+_storage_client_lock = threading.Lock()
+
+
+def get_storage_client():
+    """
+    Returns the process-wide storage client, so every upload shares one
+    authenticated session and connection pool. storage.Client honors
+    STORAGE_EMULATOR_HOST, which points it at a local GCS emulator.
+    """
+    global _storage_client
+    with _storage_client_lock:
+        if _storage_client is None:
+            _storage_client = storage.Client()
+            _size_connection_pool(_storage_client, STAGING_UPLOAD_WORKERS)
+        return _storage_client
+
+
+def _size_connection_pool(client, size):
+    """Widens the client's HTTP pool so parallel uploads don't queue for connections."""
+    session = getattr(client, "_http", None)
+    if session is None or not hasattr(session, "mount"):
+        return
+    adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
 def upload_to_gcs(bucket_name, filename, content, content_type="application/octet-stream"):
-    client = storage.Client()
+    client = get_storage_client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(filename)
     blob.upload_from_string(content, content_type=content_type)
 
 
 def download_from_gcs(bucket_name, filename):
-    client = storage.Client()
+    client = get_storage_client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(filename)
     if blob.exists():
@@ -54,27 +142,6 @@ def download_from_gcs(bucket_name, filename):
         return None
 
 
-def save_scraped_data_to_gcs(scraped_data, bucket_name, filename):
-    try:
-        content = json.dumps(scraped_data)
-        upload_to_gcs(bucket_name, filename, content, content_type="application/json")
-        logging.info("Successfully saved scraped data to GCS")
-    except Exception as e:
-        logging.error(f"Error saving scraped data to GCS: {e}")
-
-
-def load_scraped_data_from_gcs(bucket_name, filename):
-    try:
-        content = download_from_gcs(bucket_name, filename)
-        if content:
-            return json.loads(content)
-        else:
-            return None
-    except Exception as e:
-        logging.error(f"Error loading scraped data from GCS: {e}")
-        return None
-
-
 def create_rag_corpus(display_name, description):
     embedding_model = "text-embedding-004"
 
@@ -98,7 +165,8 @@ def create_rag_corpus(display_name, description):
         return False
 
 
-def import_files_to_corpus(corpus_name, paths, chunk_size=512, chunk_overlap=100, max_embedding_requests_per_min=900):
+def import_files_to_corpus(corpus_name, paths, chunk_size=512, chunk_overlap=100, max_embedding_requests_per_min=900,
+                           raise_errors=False):
     try:
         response = rag.import_files(
             corpus_name=corpus_name,
@@ -108,53 +176,50 @@ def import_files_to_corpus(corpus_name, paths, chunk_size=512, chunk_overlap=100
             max_embedding_requests_per_min=max_embedding_requests_per_min,
         )
         logging.info(f"Imported {response.imported_rag_files_count} files to {corpus_name}.")
+        corpus_changed(corpus_name)
+        return response
     except Exception as e:
         logging.error(f"Error uploading documents to RAG corpus: {e}")
+        if raise_errors:
+            raise
+        return None
 
 
-def cleanup_gcs_files(bucket_name, gcs_paths):
-    try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        for gcs_path in gcs_paths:
-            blob_name = gcs_path.replace(f"gs://{bucket_name}/", "")
-            blob = bucket.blob(blob_name)
-            if blob.exists():
-                blob.delete()
-                logging.info(f"Deleted GCS file: {gcs_path}")
-            else:
-                logging.warning(f"GCS file not found: {gcs_path}")
-    except Exception as e:
-        logging.error(f"Error during GCS cleanup: {e}")
-
-
-def cleanup_gcs_bucket_parallel(bucket_name: str, max_workers: int = 10) -> None:
-    try:
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blobs = list(bucket.list_blobs())
+def corpus_changed(corpus_name):
+    """
+    Call whenever files are added to or removed from a corpus, or it is
+    deleted: bumps the corpus' generation and drops its cached answers.
+    """
+    retrieval_cache.bump(corpus_name)
+    answer_cache.invalidate_corpus(corpus_name)
 
-        if not blobs:
-            logging.info(f"No files found in bucket '{bucket_name}'.")
-            return
 
-        def delete_blob(blob):
-            try:
-                blob.delete()
-                logging.info(f"Deleted GCS file: {blob.name}")
-            except Exception as e:
-                logging.error(f"Error deleting blob {blob.name}: {e}")
+def delete_gcs_objects(bucket_name, object_names, batch_size=GCS_DELETE_BATCH_SIZE, client=None):
+    """
+    Deletes the named objects with batched delete requests (one HTTP round
+    trip per `batch_size` objects). Objects that are already gone are ignored.
+    """
+    client = client or get_storage_client()
+    bucket = client.bucket(bucket_name)
+    object_names = list(object_names)
+    for i in range(0, len(object_names), batch_size):
+        chunk = object_names[i : i + batch_size]
+        try:
+            with client.batch(raise_exception=False):
+                for name in chunk:
+                    bucket.blob(name).delete()
+        except Exception as e:
+            logging.error(f"Error deleting {len(chunk)} objects from GCS bucket {bucket_name}: {e}")
+    logging.info(f"Deleted {len(object_names)} objects from GCS bucket {bucket_name}.")
 
-        from concurrent.futures import ThreadPoolExecutor
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            executor.map(delete_blob, blobs)
 
-        logging.info(f"All files in bucket '{bucket_name}' have been deleted.")
-    except Exception as e:
-        logging.error(f"Error during GCS bucket cleanup: {e}")
+def cleanup_gcs_files(bucket_name, gcs_paths):
+    prefix = f"gs://{bucket_name}/"
+    delete_gcs_objects(bucket_name, [path[len(prefix):] if path.startswith(prefix) else path
+                                     for path in gcs_paths])
 
 
-def get_relevant_corpora(query):
+def classify_corpora_with_llm(query):
     possible_keys = list(corpus_registry.keys())
     if not possible_keys:
         return []
@@ -181,11 +246,99 @@ If none apply, return "none".
     return relevant_corpus_list
 
 
-def generate_rag_response(query: str, mode: str = "auto", manual_corpora=None):
+def get_relevant_corpora(query):
     """
-    Generate a response from the RAG system. If mode="auto", it will
-    detect relevant corpora automatically. If mode="manual", it will
-    ONLY search within the user-provided corpora (list of display_names).
+    Chooses the corpora to search for a query with the local corpus router.
+    The Gemini classifier is only asked when the router's scores are
+    ambiguous, and only if ROUTER_LLM_FALLBACK is on; otherwise an ambiguous
+    query searches the corpora the router did match, or all of them.
+    """
+    possible_corpora = list(corpus_registry.values())
+    if not possible_corpora:
+        return []
+
+    route = corpus_router.route(query, possible_corpora)
+    logging.info(f"Corpus routing scores: {route.scores} (ambiguous: {route.ambiguous})")
+    if not route.ambiguous:
+        return route.corpora
+    if ROUTER_LLM_FALLBACK:
+        return classify_corpora_with_llm(query)
+    return route.corpora or possible_corpora
+
+
+def _query_corpus(corpus_name, query, top_k):
+    """Runs one retrieval query and caches its result; returns (contexts, seconds, error)."""
+    start = time.monotonic()
+    generation = retrieval_cache.generation(corpus_name)
+    try:
+        retrieval_source = rag.retrieval_query(
+            rag_resources=[rag.RagResource(
+                rag_corpus=corpus_name,
+            )],
+            text=query,
+            similarity_top_k=top_k,
+        )
+        contexts = list(retrieval_source.contexts.contexts)
+        retrieval_cache.put(corpus_name, query, top_k, contexts, generation)
+        return contexts, time.monotonic() - start, None
+    except Exception as e:
+        logging.error(f"Error retrieving from corpus {corpus_name}: {e}")
+        return [], time.monotonic() - start, str(e)
+
+
+def retrieve_from_corpora(query, corpora_list, top_k=RETRIEVAL_TOP_K, timeout=RETRIEVAL_TIMEOUT):
+    """
+    Queries every corpus concurrently and waits at most `timeout` seconds.
+    Returns ({corpus: contexts} for the corpora that answered, timing), where
+    timing records the status ("ok", "cached", "error" or "timeout") and duration of
+    each corpus. Results still in the retrieval cache are used without a
+    query.
+
+    Every request gets a pool with a thread per corpus it queries, so the
+    deadline covers the query alone, never time spent waiting behind other
+    requests. The SDK call cannot be interrupted: a corpus that misses the
+    deadline finishes in its own thread, and its result only fills the
+    retrieval cache.
+    """
+    start = time.monotonic()
+    results, corpora, futures = {}, {}, {}
+    misses = []
+    for corpus_name in corpora_list:
+        contexts = retrieval_cache.get(corpus_name, query, top_k)
+        if contexts is None:
+            misses.append(corpus_name)
+        else:
+            results[corpus_name] = contexts
+            corpora[corpus_name] = {"status": "cached", "seconds": 0.0, "contexts": len(contexts)}
+    if misses:
+        executor = ThreadPoolExecutor(max_workers=len(misses), thread_name_prefix="retrieval")
+        futures = {corpus_name: executor.submit(_query_corpus, corpus_name, query, top_k) for corpus_name in misses}
+        executor.shutdown(wait=False)
+    done, _ = wait(futures.values(), timeout=timeout)
+    for corpus_name, future in futures.items():
+        if future not in done:
+            logging.warning(f"Retrieval from corpus {corpus_name} missed the {timeout}s deadline")
+            corpora[corpus_name] = {"status": "timeout", "seconds": round(timeout, 3)}
+            continue
+        contexts, seconds, error = future.result()
+        if error:
+            corpora[corpus_name] = {"status": "error", "seconds": round(seconds, 3), "error": error}
+        else:
+            results[corpus_name] = contexts
+            corpora[corpus_name] = {"status": "ok", "seconds": round(seconds, 3), "contexts": len(contexts)}
+    timing = {"seconds": round(time.monotonic() - start, 3), "corpora": corpora}
+    logging.info(f"Retrieved from {len(results)} of {len(corpora)} corpora in {timing['seconds']}s")
+    return results, timing
+
+
+def prepare_rag_request(query: str, mode: str = "auto", manual_corpora=None, similar_answers=True):
+    """
+    Everything that happens before generation: resolves the corpora (see
+    generate_rag_response for the modes), looks up the answer cache (only
+    for the exact query unless `similar_answers`) and retrieves and packs
+    the context. Returns an "Error" response, a cached
+    "OK" response, or a "Ready" dict holding the prompt plus the corpora,
+    retrieval timing and context stats to report with the answer.
     """
     # If manual mode, user has provided a list of display_names
     # which we look up in corpus_registry to get the full resource names
@@ -209,31 +362,24 @@ def generate_rag_response(query: str, mode: str = "auto", manual_corpora=None):
             "response": "No relevant documentation found.",
         }
 
-    all_retrieved_docs = []
-    for corpus_name in corpora_list:
-        try:
-            retrieval_source = rag.retrieval_query(
-                rag_resources=[rag.RagResource(
-                    rag_corpus=corpus_name,
-                )],
-                text=query,
-                similarity_top_k=5,
-            )
-            retrieved_context = " ".join(
-                [context.text for context in retrieval_source.contexts.contexts]
-            ).replace("\n", "")
-            all_retrieved_docs.extend(retrieved_context)
-        except Exception as e:
-            logging.error(f"Error retrieving from corpus {corpus_name}: {e}")
+    cached = answer_cache.get(query, corpora_list, similar=similar_answers)
+    if cached:
+        return cached
 
-    if not all_retrieved_docs:
+    # Read before retrieving, so an answer built on a corpus that changes meanwhile is not cached
+    generations = {corpus_name: retrieval_cache.generation(corpus_name) for corpus_name in corpora_list}
+    retrieved, retrieval_timing = retrieve_from_corpora(query, corpora_list)
+    packed = pack_context(query, retrieved)
+
+    if not packed.chunks:
         return {
             "status": "Error",
             "response": "No matching documents across all corpora.",
+            "retrieval": retrieval_timing,
         }
 
-    context_text = "\n\n".join(all_retrieved_docs)
-    final_prompt = f"""
+    context_text = packed.text
+    prompt = f"""
 ####CONTEXT START:
 {context_text}
 
@@ -244,16 +390,57 @@ Answer the following user query, use the provided context:
 ####USER QUERY:
 {query}
 """
+    return {
+        "status": "Ready",
+        "prompt": prompt,
+        "corpus_used": corpora_list,
+        "retrieval": retrieval_timing,
+        "context": packed.stats,
+        "generations": generations,
+    }
+
+
+def _cache_answer(query, prepared, result, seconds):
+    """Caches an answer only if every corpus answered the retrieval."""
+    statuses = [timing["status"] for timing in prepared["retrieval"]["corpora"].values()]
+    if all(status in ("ok", "cached") for status in statuses):
+        answer_cache.put(query, prepared["corpus_used"], result, seconds, prepared["generations"])
+
+
+def _rag_result(prepared, answer):
+    return {
+        "status": "OK",
+        "response": answer,
+        "corpus_used": prepared["corpus_used"],
+        "retrieval": prepared["retrieval"],
+        "context": prepared["context"],
+    }
+
+
+def generate_rag_response(query: str, mode: str = "auto", manual_corpora=None, similar_answers=True):
+    """
+    Generate a response from the RAG system. If mode="auto", it will
+    detect relevant corpora automatically. If mode="manual", it will
+    ONLY search within the user-provided corpora (list of display_names).
+
+    Successful answers are cached per query and corpora (see
+    answer_cache.py) when every corpus answered the retrieval; a cached
+    answer carries a "cache" entry. similar_answers=False only serves
+    answers cached for exactly this query, for queries that carry a
+    conversation's history.
+    """
+    start = time.monotonic()
+    prepared = prepare_rag_request(query, mode, manual_corpora, similar_answers)
+    if prepared["status"] != "Ready":
+        return prepared
 
     rag_model = GenerativeModel(model_name="gemini-2.0-flash-exp")
 
     try:
-        response = rag_model.generate_content(final_prompt)
-        return {
-            "status": "OK",
-            "response": response.text,
-            "corpus_used": corpora_list
-        }
+        response = rag_model.generate_content(prepared["prompt"])
+        result = _rag_result(prepared, response.text)
+        _cache_answer(query, prepared, result, time.monotonic() - start)
+        return result
     except Exception as e:
         logging.error(f"Error in multi-corpus generation: {e}")
         return {
@@ -262,42 +449,849 @@ Answer the following user query, use the provided context:
         }
 
 
-def handle_new_documentation(url, display_name, description, scraped_data):
-    corpus_name = create_rag_corpus(display_name=display_name, description=description)
-    if not corpus_name:
-        return {"status": "Error", "message": "Could not create the corpus"}
+def stream_rag_response(query: str, mode: str = "auto", manual_corpora=None, similar_answers=True):
+    """
+    Streaming variant of generate_rag_response. Yields ("token", text)
+    for each piece of the answer as Gemini produces it, then one
+    ("done", response) or ("error", response) with the same dict
+    generate_rag_response would have returned. A cached answer arrives as
+    a single token.
+    """
+    start = time.monotonic()
+    prepared = prepare_rag_request(query, mode, manual_corpora, similar_answers)
+    if prepared["status"] == "OK":
+        yield "token", prepared["response"]
+        yield "done", prepared
+        return
+    if prepared["status"] != "Ready":
+        yield "error", prepared
+        return
+
+    rag_model = GenerativeModel(model_name="gemini-2.0-flash-exp")
+    parts = []
+    try:
+        for chunk in rag_model.generate_content(prepared["prompt"], stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text, e.g. the final one carrying only the finish reason
+                continue
+            if text:
+                parts.append(text)
+                yield "token", text
+    except Exception as e:
+        logging.error(f"Error in streaming multi-corpus generation: {e}")
+        yield "error", {
+            "status": "Error",
+            "response": "I encountered an error. Please try again later."
+        }
+        return
+    result = _rag_result(prepared, "".join(parts))
+    _cache_answer(query, prepared, result, time.monotonic() - start)
+    yield "done", result
+
+
+def staging_object_name(source, text, prefix=""):
+    """Deterministic object name for a staged document, derived from its source and content."""
+    digest = hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()
+    return f"{prefix}{digest[:32]}.txt"
+
+
+def staging_job_prefix(job_id):
+    return f"{STAGING_PREFIX}{job_id}/"
+
 
-    paths = []
-    gcs_paths = []
+def cleanup_staging_job(job_id, bucket_name=GCS_BUCKET_NAME):
+    """Deletes the files an earlier (e.g. crashed) ingestion job staged, as listed in its manifest."""
+    manifest_name = staging_job_prefix(job_id) + STAGING_MANIFEST_NAME
+    content = download_from_gcs(bucket_name, manifest_name)
+    names = json.loads(content)["objects"] if content else []
+    delete_gcs_objects(bucket_name, names + [manifest_name])
+
+
+def cleanup_stale_staging(is_active, max_age=STAGING_MAX_AGE, bucket_name=GCS_BUCKET_NAME):
+    """
+    Deletes what interrupted jobs left under STAGING_PREFIX. A job's files
+    go once `is_active(job_id)` is false (its record is finished or gone),
+    or once none of them changed for `max_age` seconds, since a job cut
+    off by a restart still looks active. Returns the number of objects deleted.
+    """
+    prefixes = {}
     try:
-        for url, text in scraped_data.items():
-            if not isinstance(text, str):
-                logging.warning(f"Non-string content found for URL {url}. Skipping...")
+        for blob in get_storage_client().list_blobs(bucket_name, prefix=STAGING_PREFIX):
+            job_id = blob.name[len(STAGING_PREFIX):].split("/", 1)[0]
+            names, updated = prefixes.get(job_id, ([], 0.0))
+            names.append(blob.name)
+            prefixes[job_id] = (names, max(updated, blob.updated.timestamp() if blob.updated else 0.0))
+    except Exception as e:
+        logging.error(f"Could not list staged files in {bucket_name}: {e}")
+        return 0
+    stale = []
+    for job_id, (names, updated) in prefixes.items():
+        if time.time() - updated > max_age or not is_active(job_id):
+            logging.info(f"Removing {len(names)} staged files left by job {job_id}")
+            stale.extend(names)
+    if stale:
+        delete_gcs_objects(bucket_name, stale)
+    return len(stale)
+
+
+class StagingUploader:
+    """
+    Stages documents in the bucket straight from memory. Uploads run on a
+    bounded thread pool and share one storage client; at most
+    2 * max_workers uploads are queued, so submit() blocks when the pool
+    falls behind. Pass `client` to use a fake or emulator-backed client.
+
+    Each uploader is one staging job: its objects live under their own
+    STAGING_PREFIX/<job id>/ prefix and are listed in a manifest stored
+    next to them, so cleanup() deletes exactly this job's files and
+    concurrent ingestions never touch each other's.
+    """
+
+    def __init__(self, bucket_name=GCS_BUCKET_NAME, client=None, max_workers=STAGING_UPLOAD_WORKERS, job_id=None):
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.job_id = job_id or uuid.uuid4().hex
+        self.prefix = staging_job_prefix(self.job_id)
+        self.manifest = []
+        self.error = None
+        self._client = client or get_storage_client()
+        self._bucket = self._client.bucket(bucket_name)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="staging")
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+        self._manifest_lock = threading.Lock()
+        self._futures = []
+
+    def _upload(self, source, text, callback):
+        try:
+            name = staging_object_name(source, text, self.prefix)
+            self._bucket.blob(name).upload_from_string(text, content_type="text/plain")
+            with self._manifest_lock:
+                self.manifest.append(name)
+                save = len(self.manifest) % STAGING_MANIFEST_INTERVAL == 0
+            if save:
+                self.save_manifest()
+            gcs_path = f"gs://{self.bucket_name}/{name}"
+            if callback:
+                callback(source, gcs_path)
+            return gcs_path
+        except Exception as e:
+            self.error = self.error or e
+            raise
+        finally:
+            self._slots.release()
+
+    def save_manifest(self):
+        """Records the staged objects so a crashed job can still be cleaned up by id."""
+        with self._manifest_lock:
+            content = json.dumps({"job_id": self.job_id, "objects": list(self.manifest)})
+        self._bucket.blob(self.prefix + STAGING_MANIFEST_NAME).upload_from_string(
+            content, content_type="application/json")
+
+    def submit(self, source, text, callback=None):
+        """
+        Schedules an upload and returns a future resolving to its gs:// path.
+        `callback(source, gcs_path)` runs on the upload thread once the object
+        is written, before the future completes.
+        """
+        self._slots.acquire()
+        if len(self._futures) > 4 * self.max_workers:
+            self._futures = [f for f in self._futures if not f.done()]
+        future = self._executor.submit(self._upload, source, text, callback)
+        self._futures.append(future)
+        return future
+
+    def wait(self):
+        """Blocks until every submitted upload has finished; raises the first upload error."""
+        wait(self._futures)
+        self._futures = []
+        if self.manifest:
+            self.save_manifest()
+        if self.error:
+            raise self.error
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def cleanup(self):
+        """Deletes every object this job staged, and its manifest."""
+        self.close()
+        with self._manifest_lock:
+            names = list(self.manifest)
+        delete_gcs_objects(self.bucket_name, names + [self.prefix + STAGING_MANIFEST_NAME], client=self._client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+class GCSCheckpointStore:
+    """Keeps crawl checkpoints in the bucket so they survive instance restarts."""
+
+    def __init__(self, bucket_name=GCS_BUCKET_NAME, prefix=CHECKPOINT_PREFIX):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def load(self, crawl_id):
+        content = download_from_gcs(self.bucket_name, f"{self.prefix}{crawl_id}.json")
+        return json.loads(content) if content else None
+
+    def save(self, crawl_id, state):
+        upload_to_gcs(self.bucket_name, f"{self.prefix}{crawl_id}.json", json.dumps(state),
+                      content_type="application/json")
+
+    def delete(self, crawl_id):
+        blob = get_storage_client().bucket(self.bucket_name).blob(f"{self.prefix}{crawl_id}.json")
+        if blob.exists():
+            blob.delete()
+
+
+# Import errors that can succeed when the call is made again
+RETRYABLE_IMPORT_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ServerError,
+    api_exceptions.Aborted,
+    ConnectionError,
+    TimeoutError,
+    FutureTimeoutError,
+)
+
+
+def _import_backoff(attempt):
+    """Exponential backoff with full jitter before import retry `attempt` (1-based)."""
+    return random.uniform(0, min(IMPORT_BACKOFF_CAP, IMPORT_BACKOFF_BASE * (2 ** (attempt - 1))))
+
+
+class CorpusImporter:
+    """
+    Imports staged files into a corpus in concurrent, retried batches.
+
+    Files are grouped into batches of up to `batch_size` files or
+    IMPORT_MAX_BATCH_BYTES. Up to `concurrency` batches are imported at once,
+    each allowed an equal share of EMBEDDING_REQUESTS_PER_MIN so that
+    together they stay within the embedding quota; add() blocks while all
+    slots are busy. A batch whose call fails with a transient error
+    (quota, server error, timeout) is retried with capped, jittered
+    backoff; other errors fail the batch at once. A batch that reports failed files is split in half to isolate
+    them, and the batch size shrinks for later batches; successes grow it
+    back. Re-importing a file that already succeeded is skipped by the
+    corpus, so retrying and splitting do not create duplicates. Once the
+    `stop` event is set, batches that have not started, and those waiting
+    to retry, fail with "stopped"; calls already running finish.
+    """
+
+    def __init__(self, corpus_name, concurrency=IMPORT_CONCURRENCY, on_imported=None,
+                 chunk_size=512, chunk_overlap=100, stop=None):
+        self.corpus_name = corpus_name
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.concurrency = max(1, concurrency)
+        self.requests_per_min = max(1, EMBEDDING_REQUESTS_PER_MIN // self.concurrency)
+        self.batch_size = IMPORT_MAX_BATCH_SIZE
+        self.batches = 0
+        self.on_imported = on_imported
+        self.stop = stop or threading.Event()
+        self.results = {}
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_bytes = 0
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="import")
+        self._futures = []
+
+    def add(self, gcs_path, sources, size=0):
+        """Queues a staged file holding `sources`; a full batch is submitted right away."""
+        self._pending.append((gcs_path, sources))
+        self._pending_bytes += size
+        if len(self._pending) >= self.batch_size or self._pending_bytes >= IMPORT_MAX_BATCH_BYTES:
+            self.flush()
+
+    def flush(self):
+        """Submits the files queued so far as one batch."""
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_bytes = self._pending, [], 0
+        self._slots.acquire()
+        self._futures.append(self._executor.submit(self._run, batch))
+
+    def close(self):
+        """Imports what is left, waits for every batch and returns the per-file results."""
+        self.flush()
+        wait(self._futures)
+        self._executor.shutdown(wait=True)
+        return self.results
+
+    def _run(self, batch):
+        try:
+            self._import(batch)
+        except Exception as e:
+            logging.error(f"Import batch failed: {e}")
+            self._record(batch, "failed", str(e))
+        finally:
+            self._slots.release()
+
+    def _import(self, batch):
+        with self._lock:
+            self.batches += 1
+            number = self.batches
+        logging.info(f"Importing batch {number} with {len(batch)} files into {self.corpus_name}")
+        error = None
+        for attempt in range(IMPORT_MAX_RETRIES + 1):
+            if self.stop.wait(_import_backoff(attempt) if attempt else 0):
+                error = "stopped"
+                break
+            try:
+                response = import_files_to_corpus(
+                    corpus_name=self.corpus_name,
+                    paths=[gcs_path for gcs_path, _ in batch],
+                    chunk_size=self.chunk_size,
+                    chunk_overlap=self.chunk_overlap,
+                    max_embedding_requests_per_min=self.requests_per_min,
+                    raise_errors=True,
+                )
+            except Exception as e:
+                error = str(e)
+                if not isinstance(e, RETRYABLE_IMPORT_ERRORS):
+                    logging.error(f"Import batch {number} failed: {e}")
+                    break
+                logging.warning(f"Import batch {number} attempt {attempt + 1} failed: {e}")
                 continue
-            with tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=False, encoding="utf-8") as tmp_file:
-                tmp_file.write(text)
-                tmp_file_path = tmp_file.name
-                paths.append(tmp_file_path)
-
-            gcs_path = f"gs://{GCS_BUCKET_NAME}/{os.path.basename(tmp_file_path)}"
-            upload_to_gcs(GCS_BUCKET_NAME, os.path.basename(tmp_file_path), text, content_type="text/plain")
-            gcs_paths.append(gcs_path)
-
-        if not gcs_paths:
-            return {"status": "Error", "message": "No valid documentation to import"}
-
-        batch_size = 25
-        for i in range(0, len(gcs_paths), batch_size):
-            batch = gcs_paths[i:i + batch_size]
-            logging.info(f"Importing batch {i // batch_size + 1} with {len(batch)} files")
-            import_files_to_corpus(corpus_name=corpus_name, paths=batch)
+            failed = getattr(response, "failed_rag_files_count", 0) or 0
+            if not failed:
+                self._resize(grow=True)
+                self._record(batch, "imported")
+                return
+            error = f"{failed} of {len(batch)} files failed to import"
+            if len(batch) > 1:
+                self._resize(grow=False)
+                middle = len(batch) // 2
+                self._import(batch[:middle])
+                self._import(batch[middle:])
+                return
+        self._record(batch, "failed", error)
+
+    def _resize(self, grow):
+        with self._lock:
+            if grow:
+                self.batch_size = min(IMPORT_MAX_BATCH_SIZE, self.batch_size + 1)
+            else:
+                self.batch_size = max(IMPORT_MIN_BATCH_SIZE, self.batch_size // 2)
+
+    def _record(self, batch, status, error=None):
+        with self._lock:
+            for gcs_path, sources in batch:
+                self.results[gcs_path] = {"sources": sources, "gcs_path": gcs_path, "status": status, "error": error}
+        if status == "imported" and self.on_imported:
+            self.on_imported([source for _, sources in batch for source in sources])
+
+
+class CorpusManifest:
+    """
+    What a corpus was built from: source URL or filename -> content hash of
+    the indexed text and the RAG file holding it. Lets re-ingestion skip
+    unchanged documents, replace changed ones and, in sync mode, remove
+    documents whose source disappeared. Stored as JSON in the bucket.
+    """
+
+    def __init__(self, corpus_name, entries=None, bucket_name=GCS_BUCKET_NAME, chunking=None):
+        self.corpus_name = corpus_name
+        self.bucket_name = bucket_name
+        self.entries = entries or {}
+        self.chunking = chunking or chunking_params()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def object_name(corpus_name):
+        return f"{CORPUS_MANIFEST_PREFIX}{hashlib.sha1(corpus_name.encode('utf-8')).hexdigest()}.json"
+
+    @classmethod
+    def load(cls, corpus_name, bucket_name=GCS_BUCKET_NAME):
+        try:
+            content = download_from_gcs(bucket_name, cls.object_name(corpus_name))
+            data = json.loads(content) if content else {}
+        except Exception as e:
+            logging.error(f"Could not load the manifest of {corpus_name}, starting empty: {e}")
+            data = {}
+        return cls(corpus_name, data.get("sources"), bucket_name, data.get("chunking"))
+
+    def save(self):
+        with self._lock:
+            content = json.dumps({"corpus_name": self.corpus_name, "chunking": self.chunking,
+                                  "sources": self.entries})
+        upload_to_gcs(self.bucket_name, self.object_name(self.corpus_name), content,
+                      content_type="application/json")
+
+    def delete(self):
+        delete_gcs_objects(self.bucket_name, [self.object_name(self.corpus_name)])
+
+    def is_current(self, source, digest):
+        entry = self.entries.get(source)
+        return bool(entry and entry["hash"] == digest and entry.get("rag_file"))
+
+    def rag_file(self, source):
+        entry = self.entries.get(source)
+        return entry.get("rag_file") if entry else None
+
+    def shard(self, source):
+        """Object holding the texts of the shard the source was packed into, if any."""
+        entry = self.entries.get(source)
+        return entry.get("shard") if entry else None
+
+    def set(self, source, digest, rag_file, shard=None):
+        with self._lock:
+            self.entries[source] = {"hash": digest, "rag_file": rag_file}
+            if shard:
+                self.entries[source]["shard"] = shard
+
+    def remove(self, source):
+        with self._lock:
+            self.entries.pop(source, None)
+
+    def shard_object_name(self, staged_name):
+        """Where the member texts of the shard staged as `staged_name` are kept."""
+        corpus_hash = hashlib.sha1(self.corpus_name.encode("utf-8")).hexdigest()
+        return f"{CORPUS_MANIFEST_PREFIX}shards/{corpus_hash}/{staged_name.rsplit('.', 1)[0]}.json"
+
+    def save_shard(self, staged_name, texts):
+        """Keeps the {source: text} members of a shard so they can be staged again without their source."""
+        upload_to_gcs(self.bucket_name, self.shard_object_name(staged_name), json.dumps(texts),
+                      content_type="application/json")
+
+    def load_shard(self, object_name):
+        """{source: text} of a stored shard, or {} if it cannot be read."""
+        try:
+            content = download_from_gcs(self.bucket_name, object_name)
+            return json.loads(content) if content else {}
+        except Exception as e:
+            logging.error(f"Could not load shard texts {object_name}: {e}")
+            return {}
+
+
+def list_rag_file_names(corpus_name):
+    """Maps the file name each RAG file was imported from to the RAG file's resource name."""
+    names = {}
+    for rag_file in rag.list_files(corpus_name=corpus_name):
+        uris = list(getattr(getattr(rag_file, "gcs_source", None), "uris", None) or [])
+        for source_name in uris + [rag_file.display_name]:
+            names[source_name.rsplit("/", 1)[-1]] = rag_file.name
+    return names
+
+
+def delete_rag_files(rag_file_names, max_workers=8):
+    """Deletes RAG files in parallel; returns how many were deleted."""
+    def delete(name):
+        try:
+            rag.delete_file(name=name)
+            return True
+        except Exception as e:
+            logging.error(f"Error deleting RAG file {name}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(delete, rag_file_names))
+
+
+def _update_manifest(manifest, corpus_name, files, hashes, seen, sync):
+    """
+    Records the files imported by an ingestion in the corpus manifest,
+    removes sources that were not seen when syncing, and deletes the RAG
+    files no source refers to anymore. Returns the number of RAG files
+    deleted.
+
+    A shard (a RAG file packed from several sources) is deleted as soon as
+    one of its sources moves out or is removed, since it still holds that
+    source's old text; ingest_documents stages its other sources again from
+    the shard's stored texts. Sources that could not be staged again lose
+    their RAG file in the manifest, so the next ingestion that sees them
+    stages them anew. Stored shard texts go with their RAG file.
+    """
+    imported = [f for f in files if f["status"] == "imported"]
+    rag_files = list_rag_file_names(corpus_name) if imported else {}
+    previous = {entry.get("rag_file"): entry.get("shard") for entry in manifest.entries.values()}
+    members = {}
+    for source, entry in manifest.entries.items():
+        members.setdefault(entry.get("rag_file"), set()).add(source)
+    for f in imported:
+        staged_name = f["gcs_path"].rsplit("/", 1)[-1]
+        new_rag_file = rag_files.get(staged_name)
+        shard = manifest.shard_object_name(staged_name) if len(f["sources"]) > 1 else None
+        for source in f["sources"]:
+            manifest.set(source, hashes[source], new_rag_file, shard)
+    if sync:
+        for source in set(manifest.entries) - seen:
+            manifest.remove(source)
+    for rag_file, sources in members.items():
+        left = {source for source in sources if manifest.rag_file(source) == rag_file}
+        if rag_file and left and left != sources:
+            for source in left:
+                manifest.set(source, manifest.entries[source]["hash"], None)
+            logging.warning(f"Shard {rag_file} lost a source; {len(left)} other sources "
+                            f"are staged again on their next ingestion")
+    current = {entry.get("rag_file") for entry in manifest.entries.values()}
+    stale = [rag_file for rag_file in set(previous) - current if rag_file]
+    deleted = delete_rag_files(stale) if stale else 0
+    # Texts of shards that were replaced, or that were staged but never imported
+    unused_shards = [previous[rag_file] for rag_file in stale if previous[rag_file]]
+    unused_shards += [manifest.shard_object_name(f["gcs_path"].rsplit("/", 1)[-1])
+                      for f in files if f["status"] != "imported" and len(f["sources"]) > 1]
+    if unused_shards:
+        delete_gcs_objects(manifest.bucket_name, unused_shards)
+    if deleted:
+        corpus_changed(corpus_name)
+    manifest.save()
+    return deleted
+
+
+_STAGE_DONE = object()
+
+
+def _put_until_stopped(q, item, stop_event):
+    """Blocks on a full queue until there is room, unless the pipeline stops."""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get_until_stopped(q, stop_event):
+    """Blocks on an empty queue until an item arrives; returns _STAGE_DONE if the pipeline stops."""
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _STAGE_DONE
+
+
+_corpus_ingest_locks = {}
+_corpus_ingest_locks_lock = threading.Lock()
+
+
+def _corpus_ingest_lock(corpus_name):
+    """The lock serializing ingestions (and so manifest updates) of one corpus."""
+    with _corpus_ingest_locks_lock:
+        return _corpus_ingest_locks.setdefault(corpus_name, threading.Lock())
+
+
+def ingest_documents(corpus_name, documents, on_document=None, on_imported=None,
+                     known_hashes=None, sync=False, chunking=None, on_progress=None,
+                     fetch_errors=None, job_id=None, check_cancelled=None, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Indexes documents into a corpus. Every ingestion endpoint goes through
+    here. `documents` is a {source: text} dict or an iterable of
+    (source, text) pairs, streamed through connected stages:
+
+        documents (crawl + extract) -> dedup -> chunk + pack -> parallel GCS upload -> CorpusImporter
+
+    `documents` may be a lazy generator such as scraper.iter_documentation,
+    so pages are uploaded and imported while the crawl is still running.
+    The stages are linked by bounded queues: when a downstream stage falls
+    behind, the upstream one blocks, which keeps memory flat however large
+    the crawl is. `on_document` is called for every document that passes
+    deduplication, and `on_imported` with the sources of every batch once
+    it has been imported. `on_progress(name, amount)` receives running
+    counts of files_staged, batches_imported and documents_imported.
+    `known_hashes` ({source: exact hash}) marks
+    content indexed by an earlier run, such as an interrupted crawl being
+    resumed, as already seen by deduplication.
+
+    Documents are checked against the corpus manifest first: unchanged
+    ones are skipped, changed ones replace their previous RAG file. With
+    `sync`, RAG files of manifest sources that are neither in `documents`
+    nor in `known_hashes` are deleted, so the corpus mirrors the source.
+    `fetch_errors` is a collection the crawl fills with URLs it could not
+    fetch (see scraper.iter_documentation's on_failed); if it is not
+    empty once `documents` is exhausted, nothing is deleted, since those
+    pages and the pages only linked from them were never seen.
+
+    Documents get their source marker repeated at heading and paragraph
+    boundaries, and small ones are packed into shard files (see
+    chunking.ShardPacker), so each chunk Vertex cuts names its source. The
+    member texts of every shard are kept next to the manifest: when one
+    member changes or goes away, the others are staged again from there so
+    the old shard can be deleted. `chunking` ({"chunk_size",
+    "chunk_overlap"}) sets the corpus' chunk parameters, which are kept in
+    its manifest for later ingestions.
+
+    Ingestions into the same corpus run one at a time, since each one
+    loads the corpus manifest at the start and saves it at the end; a
+    second job waits for the first to finish.
+
+    `check_cancelled` (such as jobs.Job.check_cancelled) is called for
+    every document and about every half second while staging and importing
+    go on, and while waiting for the corpus. Once it raises, no new file is
+    uploaded or import started, what was already imported is recorded in
+    the manifest and its exception is raised.
+
+    Returns document counts, dedup statistics and a per-file result list. Files are
+    staged under the prefix of `job_id` (the background job running the
+    ingestion, or a random id) and only those are removed afterwards.
+    """
+    lock = _corpus_ingest_lock(corpus_name)
+    if not lock.acquire(blocking=False):
+        logging.info(f"Waiting for another ingestion into {corpus_name} to finish")
+        while not lock.acquire(timeout=0.5):
+            if check_cancelled:
+                check_cancelled()
+    try:
+        return _ingest_documents(corpus_name, documents, on_document, on_imported, known_hashes, sync,
+                                 chunking, on_progress, fetch_errors, job_id, check_cancelled, queue_size)
     finally:
-        for path in paths:
-            os.remove(path)
-        cleanup_gcs_bucket_parallel(GCS_BUCKET_NAME)
+        lock.release()
+
+
+def _ingest_documents(corpus_name, documents, on_document, on_imported, known_hashes, sync,
+                      chunking, on_progress, fetch_errors, job_id, check_cancelled, queue_size):
+    if isinstance(documents, dict):
+        documents = documents.items()
+    upload_queue = queue.Queue(maxsize=queue_size)
+    import_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    dedup_filter = NearDuplicateFilter()
+    for source, digest in (known_hashes or {}).items():
+        dedup_filter.seed_exact(source, digest)
+    staged = {}
+    stats = {"documents": 0, "unchanged": 0, "uploaded": 0}
+    manifest = CorpusManifest.load(corpus_name)
+    if chunking:
+        manifest.chunking = chunking_params(**chunking)
+    packer = ShardPacker(chunk_size=manifest.chunking["chunk_size"])
+    # Texts of the documents waiting in the packer, kept with the shard they end up in
+    packed_texts = {}
+    hashes = {}
+    seen = set(known_hashes or ())
+    profile = ProfileBuilder()
+
+    progress = on_progress or (lambda name, amount=1: None)
+
+    def on_batch_imported(sources):
+        progress("batches_imported")
+        progress("documents_imported", len(sources))
+        if on_imported:
+            on_imported(sources)
+
+    uploader = StagingUploader(job_id=job_id)
+    importer = CorpusImporter(corpus_name, on_imported=on_batch_imported, stop=stop, **manifest.chunking)
+    stats_lock = threading.Lock()
+
+    def on_uploaded(sources, gcs_path, size):
+        with stats_lock:
+            staged[gcs_path] = sources
+            stats["uploaded"] += 1
+        progress("files_staged")
+        _put_until_stopped(import_queue, (gcs_path, sources, size), stop)
+
+    def stage(units):
+        for sources, text in units:
+            members = {source: packed_texts.pop(source) for source in sources}
+            if len(sources) > 1:
+                try:
+                    manifest.save_shard(staging_object_name(sources[0], text), members)
+                except Exception as e:
+                    # Its members can then only be staged again once they are seen
+                    logging.error(f"Could not keep the texts of a shard of {len(sources)} documents: {e}")
+            if not _put_until_stopped(upload_queue, (sources, text), stop):
+                return False
+        return True
+
+    def upload_stage():
+        try:
+            while True:
+                item = _get_until_stopped(upload_queue, stop)
+                if item is _STAGE_DONE or uploader.error:
+                    break
+                sources, text = item
+                size = len(text.encode("utf-8"))
+                uploader.submit(sources[0], text,
+                                callback=lambda _, p, sources=sources, size=size: on_uploaded(sources, p, size))
+            uploader.wait()
+        except Exception as e:
+            logging.error(f"Upload stage failed: {e}")
+            errors.append(e)
+            stop.set()
+        finally:
+            _put_until_stopped(import_queue, _STAGE_DONE, stop)
+
+    def import_stage():
+        try:
+            while True:
+                item = _get_until_stopped(import_queue, stop)
+                if item is _STAGE_DONE:
+                    break
+                importer.add(*item)
+        except Exception as e:
+            logging.error(f"Import stage failed: {e}")
+            errors.append(e)
+            stop.set()
+
+    def check_stage():
+        while not stop.wait(0.5):
+            try:
+                check_cancelled()
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+    workers = [
+        threading.Thread(target=upload_stage, name="ingest-upload", daemon=True),
+        threading.Thread(target=import_stage, name="ingest-import", daemon=True),
+    ]
+    watcher = threading.Thread(target=check_stage, name="ingest-cancel", daemon=True)
+    if check_cancelled:
+        watcher.start()
+    for worker in workers:
+        worker.start()
+
+    try:
+        for source, text in documents:
+            if stop.is_set():
+                break
+            if check_cancelled:
+                check_cancelled()
+            if not isinstance(text, str) or not text.strip():
+                logging.warning(f"No valid text for {source}. Skipping...")
+                continue
+            seen.add(source)
+            digest = exact_hash(text)
+            if manifest.is_current(source, digest):
+                dedup_filter.seed_exact(source, digest)
+                stats["unchanged"] += 1
+                if on_document:
+                    on_document(source, text)
+                if on_imported:
+                    on_imported([source])
+                continue
+            if dedup_filter.check(source, text) is not None:
+                continue
+            hashes[source] = digest
+            stats["documents"] += 1
+            profile.add(text)
+            if on_document:
+                on_document(source, text)
+            packed_texts[source] = text
+            if not stage(packer.add(source, text)):
+                break
+        else:
+            if sync and fetch_errors:
+                logging.warning(f"{len(fetch_errors)} pages could not be fetched; "
+                                f"keeping sources that were not seen in {corpus_name}")
+                sync = False
+            # Re-stage the unchanged members of shards that lose a member, so the shard can go
+            leaving = set(hashes)
+            if sync:
+                leaving |= set(manifest.entries) - seen
+            dirty = {manifest.rag_file(source) for source in leaving if manifest.shard(source)} - {None}
+            shard_texts = {}
+            for source, entry in list(manifest.entries.items()):
+                if source in leaving or entry.get("rag_file") not in dirty:
+                    continue
+                if entry["shard"] not in shard_texts:
+                    shard_texts[entry["shard"]] = manifest.load_shard(entry["shard"])
+                text = shard_texts[entry["shard"]].get(source)
+                if text is None:
+                    continue
+                hashes[source] = entry["hash"]
+                packed_texts[source] = text
+                if not stage(packer.add(source, text)):
+                    break
+            else:
+                stage(packer.flush())
+    except Exception as e:
+        logging.error(f"Document stage failed: {e}")
+        errors.append(e)
+        stop.set()
+    finally:
+        _put_until_stopped(upload_queue, _STAGE_DONE, stop)
+        for worker in workers:
+            worker.join()
+        uploader.close()
+        results = importer.close()
+        uploader.cleanup()
+        if watcher.is_alive():
+            stop.set()
+            watcher.join()
+
+    files = [results.get(path, {"sources": sources, "gcs_path": path, "status": "failed", "error": "not imported"})
+             for path, sources in staged.items()]
+    if errors:
+        # Still record what was imported, but never delete sources after a partial run
+        _update_manifest(manifest, corpus_name, files, hashes, seen, sync=False)
+        raise errors[0]
+    if dedup_filter.stats["pages_removed"]:
+        logging.info(f"Deduplication removed {dedup_filter.stats['pages_removed']} pages "
+                     f"({dedup_filter.stats['bytes_removed']} bytes).")
+    imported = sum(len(f["sources"]) for f in files if f["status"] == "imported")
+    failed = sum(len(f["sources"]) for f in files if f["status"] != "imported")
+    logging.info(f"Ingested {imported} documents in {len(files)} files into {corpus_name} "
+                 f"in {importer.batches} batches; {stats['unchanged']} unchanged.")
+    deleted = _update_manifest(manifest, corpus_name, files, hashes, seen, sync)
+    if imported:
+        corpus_router.update(corpus_name, profile)
+    return {
+        **stats,
+        "deleted": deleted,
+        "imported": imported,
+        "failed": failed,
+        "imported_batches": importer.batches,
+        "packing": packer.stats,
+        "fetch_errors": len(fetch_errors or ()),
+        "dedup": dedup_filter.stats,
+        "files": files,
+    }
+
+
+def ingestion_summary(result):
+    """Compact view of an ingest_documents result for API responses."""
+    return {
+        "documents": result["documents"],
+        "unchanged": result["unchanged"],
+        "imported": result["imported"],
+        "deleted": result["deleted"],
+        "failed": result["failed"],
+        "fetch_errors": result["fetch_errors"],
+        "files": result["uploaded"],
+        "batches": result["imported_batches"],
+        "failed_files": [{"source": source, "error": f.get("error")}
+                         for f in result["files"] if f["status"] != "imported" for source in f["sources"]],
+        "dedup": result["dedup"],
+    }
+
+
+def handle_new_documentation(url, display_name, description, scraped_data, on_document=None,
+                             on_imported=None, known_hashes=None, sync=False, chunking=None, on_progress=None,
+                             fetch_errors=None, job_id=None, check_cancelled=None):
+    """
+    Creates (or reuses) a corpus and indexes the documents into it with
+    ingest_documents, which also receives the callbacks, `known_hashes`,
+    `sync`, `chunking`, `fetch_errors`, `job_id` and `check_cancelled`.
+    """
+    corpus_name = create_rag_corpus(display_name=display_name, description=description)
+    if not corpus_name:
+        return {"status": "Error", "message": "Could not create the corpus"}
+
+    result = ingest_documents(corpus_name, scraped_data, on_document=on_document,
+                              on_imported=on_imported, known_hashes=known_hashes, sync=sync,
+                              chunking=chunking, on_progress=on_progress, fetch_errors=fetch_errors,
+                              job_id=job_id, check_cancelled=check_cancelled)
+    if not result["imported"] and not result["unchanged"]:
+        return {"status": "Error", "message": "No valid documentation to import",
+                "ingestion": ingestion_summary(result)}
 
     corpus_registry[display_name] = corpus_name
-    return {"status": "OK", "message": "Documentation indexed successfully!", "corpus_name": corpus_name}
+    corpus_router.describe(corpus_name, display_name, description)
+    return {
+        "status": "OK",
+        "message": "Documentation indexed successfully!",
+        "corpus_name": corpus_name,
+        "ingestion": ingestion_summary(result),
+    }
 
 
 def load_corpus_registry():
@@ -322,73 +1316,9 @@ def delete_corpora():
         corpora = rag.list_corpora()
         for corpus in corpora:
             rag.delete_corpus(corpus.name)
+            CorpusManifest(corpus.name).delete()
+            corpus_router.remove(corpus.name)
+            corpus_changed(corpus.name)
             logging.info(f"Deleted RAG corpus: {corpus.name}")
     except Exception as e:
         logging.error(f"Error deleting RAG corpora: {e}")
-
-
-def extract_text_from_file(file_bytes: bytes, filename: str) -> str:
-    ext = os.path.splitext(filename.lower())[1]
-
-    if ext == ".pdf":
-        try:
-            with io.BytesIO(file_bytes) as pdf_stream:
-                pdf_reader = PyPDF2.PdfReader(pdf_stream)
-                all_text = []
-                for page in pdf_reader.pages:
-                    text = page.extract_text()
-                    if text:
-                        all_text.append(text)
-            return "\n".join(all_text)
-        except Exception as e:
-            logging.error(f"Error parsing PDF {filename}: {e}")
-            return ""
-
-    elif ext == ".docx":
-        try:
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-                tmp.write(file_bytes)
-                tmp.flush()
-                text = docx2txt.process(tmp.name)
-            return text
-        except Exception as e:
-            logging.error(f"Error parsing DOCX {filename}: {e}")
-            return ""
-
-    elif ext == ".doc":
-        logging.warning("DOC parsing not natively supported.")
-        return ""
-
-    elif ext == ".xlsx":
-        try:
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-                tmp.write(file_bytes)
-                tmp.flush()
-                wb = openpyxl.load_workbook(tmp.name, data_only=True)
-                all_text = []
-                for sheet_name in wb.sheetnames:
-                    sheet = wb[sheet_name]
-                    for row in sheet.iter_rows(values_only=True):
-                        row_text = [str(cell) for cell in row if cell is not None]
-                        if row_text:
-                            all_text.append(" | ".join(row_text))
-                return "\n".join(all_text)
-        except Exception as e:
-            logging.error(f"Error parsing XLSX {filename}: {e}")
-            return ""
-
-    elif ext == ".xls":
-        logging.warning("XLS parsing not implemented.")
-        return ""
-
-    elif ext == ".txt":
-        try:
-            return file_bytes.decode("utf-8", errors="replace")
-        except Exception as e:
-            logging.error(f"Error parsing TXT {filename}: {e}")
-            return ""
-    else:
-        logging.warning(f"Unsupported file format for {filename}")
-        return ""
@@ -1,11 +1,56 @@
 import streamlit as st
 import requests
 import os
+import time
+import json
+from requests_toolbelt import MultipartEncoder
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8080")
 
 st.set_page_config(page_title="Doc Chat Assistant", layout="wide")
 
+
+def post_files(url, uploaded_files, fields=None):
+    """Posts files as multipart form data, streaming each file instead of building the whole body in memory."""
+    parts = list((fields or {}).items())
+    for f in uploaded_files:
+        f.seek(0)
+        parts.append(("files", (f.name, f, f.type or "application/octet-stream")))
+    encoder = MultipartEncoder(fields=parts)
+    return requests.post(url, data=encoder, headers={"Content-Type": encoder.content_type})
+
+
+def wait_for_job(resp, success_message):
+    """Follows a scrape/upload job started by resp, showing its progress until it finishes."""
+    if resp.status_code != 202:
+        st.error(f"Error: {resp.text}")
+        return
+    job_id = resp.json()["job_id"]
+    status = st.empty()
+    while True:
+        job = requests.get(f"{BACKEND_URL}/jobs/{job_id}").json()
+        progress = ", ".join(f"{name.replace('_', ' ')}: {count}" for name, count in job["progress"].items())
+        status.info(f"Job {job['status']}... {progress}")
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(2)
+    if job["status"] == "succeeded":
+        status.success(f"{success_message} {job['result'].get('message', '')}")
+    else:
+        status.error(f"Job {job['status']}: {job.get('error')}")
+
+def stream_events(resp):
+    """Yields (event, data) for each server-sent event of a streaming response."""
+    event, data = "message", []
+    for line in resp.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and data:
+            yield event, json.loads("\n".join(data))
+            event, data = "message", []
+
 ##############################
 # SIDEBAR: Conversations
 ##############################
@@ -108,6 +153,7 @@ with st.expander("Scrape Documentation"):
         display_name = st.text_input("Enter a display name for the new corpus:")
         description = st.text_area("Enter a description for the new corpus:")
         max_pages = st.number_input("Max pages to scrape", min_value=1, value=50, step=1)
+        discovery = st.selectbox("Page discovery", ["links", "sitemap", "both"])
 
         if st.button("Scrape to NEW Corpus"):
             if not base_url or not display_name or not description:
@@ -117,14 +163,12 @@ with st.expander("Scrape Documentation"):
                     "base_url": base_url,
                     "max_pages": max_pages,
                     "display_name": display_name,
-                    "description": description
+                    "description": description,
+                    "discovery": discovery
                 }
                 try:
                     resp = requests.post(f"{BACKEND_URL}/scrape", json=payload)
-                    if resp.status_code == 200:
-                        st.success("Scraping completed! Data indexed in new corpus.")
-                    else:
-                        st.error(f"Error: {resp.text}")
+                    wait_for_job(resp, "Scraping completed! Data indexed in new corpus.")
                 except Exception as e:
                     st.error(f"Request failed: {e}")
 
@@ -134,6 +178,8 @@ with st.expander("Scrape Documentation"):
         else:
             base_url_existing = st.text_input("Enter documentation base URL:")
             max_pages_existing = st.number_input("Max pages to scrape", min_value=1, value=50, step=1)
+            discovery_existing = st.selectbox("Page discovery", ["links", "sitemap", "both"])
+            sync_existing = st.checkbox("Sync (skip unchanged pages, remove pages no longer on the site)")
             # Choose from existing corpora
             corpus_display_names = [c["display_name"] for c in all_corpora]
             selected_corpus = st.selectbox("Choose existing corpus", corpus_display_names)
@@ -151,14 +197,16 @@ with st.expander("Scrape Documentation"):
                     if not corpus_full_name:
                         st.error("Selected corpus not found in registry.")
                     else:
-                        payload = {"base_url": base_url_existing, "max_pages": max_pages_existing}
+                        payload = {
+                            "base_url": base_url_existing,
+                            "max_pages": max_pages_existing,
+                            "discovery": discovery_existing,
+                            "sync": sync_existing
+                        }
                         endpoint = f"{BACKEND_URL}/rag_corpora/{corpus_full_name}/scrape"
                         try:
                             resp = requests.post(endpoint, json=payload)
-                            if resp.status_code == 200:
-                                st.success(f"Scraped and imported into {selected_corpus}!")
-                            else:
-                                st.error(f"Error: {resp.text}")
+                            wait_for_job(resp, f"Scraped and imported into {selected_corpus}!")
                         except Exception as ex:
                             st.error(f"Request failed: {ex}")
 
@@ -191,23 +239,16 @@ with st.expander("Upload Documents (PDF, DOCX, Excel, etc.)"):
             elif not uploaded_files:
                 st.warning("Please select at least one file.")
             else:
-                files_data = []
-                for f in uploaded_files:
-                    files_data.append(("files", (f.name, f.read(), f"type")))
-
                 try:
-                    resp = requests.post(
+                    resp = post_files(
                         f"{BACKEND_URL}/upload",
-                        data={
+                        uploaded_files,
+                        {
                             "display_name": display_name_upload,
                             "description": description_upload
-                        },
-                        files=files_data
+                        }
                     )
-                    if resp.status_code == 200:
-                        st.success("File(s) uploaded and indexed in new corpus!")
-                    else:
-                        st.error(f"Error: {resp.text}")
+                    wait_for_job(resp, "File(s) uploaded and indexed in new corpus!")
                 except Exception as e:
                     st.error(f"Request failed: {e}")
 
@@ -230,17 +271,10 @@ with st.expander("Upload Documents (PDF, DOCX, Excel, etc.)"):
                     if not corpus_full_name:
                         st.error("Selected corpus not found.")
                     else:
-                        files_data = []
-                        for f in uploaded_files:
-                            files_data.append(("files", (f.name, f.read(), f"type")))
-
                         endpoint = f"{BACKEND_URL}/rag_corpora/{corpus_full_name}/add_data"
                         try:
-                            add_resp = requests.post(endpoint, files=files_data)
-                            if add_resp.status_code == 200:
-                                st.success("Files added successfully to existing corpus!")
-                            else:
-                                st.error(f"Error: {add_resp.text}")
+                            add_resp = post_files(endpoint, uploaded_files)
+                            wait_for_job(add_resp, "Files added successfully to existing corpus!")
                         except Exception as e:
                             st.error(f"Request failed: {e}")
 
@@ -309,12 +343,21 @@ else:
                 "mode": mode,
                 "selected_corpora": selected_corpora_manual
             }
+            st.markdown(f"**You:** {user_input}")
+            answer = st.empty()
+            reply = ""
             try:
-                resp = requests.post(
-                    f"{BACKEND_URL}/conversations/{conversation_id}/chat",
-                    json=body
-                )
-                resp.raise_for_status()
+                # Render the reply as it streams in; the backend stores it once the stream ends
+                with requests.post(
+                    f"{BACKEND_URL}/conversations/{conversation_id}/chat/stream",
+                    json=body,
+                    stream=True
+                ) as resp:
+                    resp.raise_for_status()
+                    for event, data in stream_events(resp):
+                        if event == "token":
+                            reply += data["text"]
+                            answer.markdown(f"**Assistant:** {reply}")
                 st.rerun()
             except requests.exceptions.RequestException as e:
                 st.error(f"Error sending message: {e}")